@@ -57,13 +57,18 @@
       # Fetch private submodule from local path with submodules enabled
       # Uses HOME env var for portability (requires --impure flag)
       # Uses ref="main" instead of allRefs=true to avoid exposing entire git history
+      # When building from a source snapshot that already contains private/
+      # (rebuild --ship-source), use that copy so the build is pinned to it
       private =
-        builtins.fetchGit {
-          url = "file://${builtins.getEnv "HOME"}/.config/nix/config";
-          submodules = true;
-          ref = "main";
-        }
-        + "/private";
+        if builtins.pathExists (inputs.self + "/private/nodes.json") then
+          inputs.self + "/private"
+        else
+          builtins.fetchGit {
+            url = "file://${builtins.getEnv "HOME"}/.config/nix/config";
+            submodules = true;
+            ref = "main";
+          }
+          + "/private";
 
       # Proxmox cluster nodes for daemon LXCs and pct commands
       # Maps node name -> Proxmox host IP (for SSH access as root)
@@ -0,0 +1,4 @@
+# NCPS binary cache, shared by the nix settings (cache.nix) and the rebuild script (shell-common.nix)
+{
+  url = "https://ncps.hyades.io";
+}
@@ -5,11 +5,13 @@
   ...
 }:
 let
+  binaryCache = import ./binary-cache.nix;
+
   uploadToCache = pkgs.writeShellScript "upload-to-cache" ''
     set -f
     export IFS=' '
     echo "Uploading to NCPS:" $OUT_PATHS
-    ${config.nix.package}/bin/nix copy --to 'https://ncps.hyades.io' $OUT_PATHS || true
+    ${config.nix.package}/bin/nix copy --to '${binaryCache.url}' $OUT_PATHS || true
   '';
 in
 {
@@ -18,7 +20,7 @@ in
       connect-timeout = 5;
       fallback = true;
       substituters = [
-        "https://ncps.hyades.io"
+        binaryCache.url
         "https://nix-community.cachix.org"
         "https://cache.nixos.org"
       ];
@@ -28,7 +30,7 @@ in
         "nix-community.cachix.org-1:mB9FSh9qf2dCimDSUo8Zy7bkq5CX+/rkCWyvRCYg3Fs="
       ];
       trusted-substituters = [
-        "https://ncps.hyades.io"
+        binaryCache.url
       ];
       trusted-users = [
         "kamushadenes"
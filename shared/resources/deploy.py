@@ -7,14 +7,29 @@ Usage:
     rebuild aether       # Deploy to single target
     rebuild -vL cloudflared  # Build locally, push closure to remote via SSH
     rebuild -vR aether       # SSH into remote and build there (no local pre-build)
+    rebuild --mode=auto @nixos  # Pick cache fetch, -L or -R per node (closure size, link speed)
+    rebuild -pL --fan-out @headless  # Push once per site, nodes copy on to their siblings
     rebuild @headless    # Deploy to all nodes with @headless tag
     rebuild @nixos       # Deploy to all NixOS machines
     rebuild @darwin      # Deploy to all Darwin machines
     rebuild -p @darwin   # Parallel deploy to all Darwin machines
     rebuild --all        # Deploy to all machines
+    rebuild --lookahead 2 @nixos  # One at a time, building the next 2 nodes meanwhile
     rebuild -pa          # Parallel deploy to all machines
     rebuild --list       # List nodes and tags
     rebuild -n @nixos    # Dry run - show what would deploy
+    rebuild -f @nixos    # Redeploy even nodes already on the evaluated system
+    rebuild -pa --keep-going  # Do not skip nodes that share an already failed build
+    rebuild -p -j 4 --eval-max-rss 3072 @nixos  # At most 4 nodes/eval workers at once, 3GiB RSS cap each
+    rebuild --race-hosts aether  # Probe all targetHosts at once, use the first to answer
+    rebuild --retries 4 @nixos  # Retry SSH connection errors up to 4 times per step
+    rebuild --refresh-reachability  # Forget cached working hosts / Tailscale state
+    rebuild -p --resume  # Redeploy what an interrupted/failed multi-node run left unfinished
+    rebuild -p --timings --events-file ~/rebuild-events.jsonl @nixos  # Per-phase timings
+    rebuild --gc=always aether  # Old cleanup: nix-collect-garbage -d right after the deploy
+    rebuild --stage @headless   # Realise new systems on the remotes without activating
+    rebuild -p --ship-source @nixos  # Remotes rebuild from one store snapshot, no git pull
+    rebuild --switch            # Activate everything staged, all at once
     rebuild --proxmox    # Build Proxmox VM (qcow2) and LXC images
     rebuild --proxmox-vm # Build Proxmox VM image (.vma.zst, currently broken)
     rebuild --proxmox-vm-qcow2 # Build Proxmox VM image (.qcow2, use qm importdisk)
@@ -22,26 +37,43 @@ Usage:
 """
 
 import asyncio
+import http.client
 import ipaddress
 import json
+import math
 import os
+import random
 import re
 import shutil
 import socket
+import sqlite3
 import subprocess
 import sys
+import tempfile
+import threading
+import time
+import urllib.parse
 from argparse import ArgumentParser
-from dataclasses import dataclass
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from dataclasses import dataclass, field, replace
 from functools import lru_cache
 
 # Paths
 FLAKE_PATH = os.path.expanduser("~/.config/nix/config")
 NODES_JSON_PATH = os.path.join(FLAKE_PATH, "private", "nodes.json")
+CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "rebuild")
+REACHABILITY_CACHE_PATH = os.path.join(CACHE_DIR, "reachability.json")
+HISTORY_DB_PATH = os.path.join(CACHE_DIR, "history.sqlite")
+STAGED_PATH = os.path.join(CACHE_DIR, "staged.json")
+JOURNAL_PATH = os.path.join(CACHE_DIR, "journal.json")
 CACHE_KEY_PATH = "@cacheKeyPath@"
 CACHE_KEY_AGE_PATH = "@cacheKeyAgePath@"
 AGE_IDENTITY = "@ageIdentity@"
 AGE_BIN = "@ageBin@"
 NIX_REMOTE_SETUP = "@nixRemoteSetup@"
+NIX_EVAL_JOBS = "@nixEvalJobs@"
 
 # ANSI colors for terminal output
 GREEN = "\033[32m"
@@ -61,10 +93,553 @@ PVE_NODES = {
     "pve3": "10.23.5.12",
 }
 
-# Extra resources added to LXC containers during rebuild
+# How long cached reachability results are trusted
+REACHABILITY_TTL = 6 * 3600  # seconds, last working targetHost per node
+TAILSCALE_STATE_TTL = 300  # seconds, Tailscale BackendState
+
+# Head start each targetHost gets over the next one when racing (--race-hosts)
+HOST_RACE_STAGGER = 0.25  # seconds
+
+# Idle time after which a shared SSH master exits on its own (if the run dies before closing it)
+SSH_CONTROL_PERSIST = 60  # seconds
+
+# How often a batched build checks which toplevels are already realised
+BATCH_POLL_INTERVAL = 2  # seconds
+
+# How many recent successful runs predictions are averaged over
+HISTORY_SAMPLES = 5
+
+# How long `pct set` requests for the same PVE host are collected into one SSH call
+PVE_BATCH_WINDOW = 0.2  # seconds
+
+# RAM left unpromised on a PVE host when admitting concurrent LXC boosts
+PVE_MEMORY_RESERVE = 2048  # MiB
+
+# How much of a build/deploy command's output is kept for failure reports
+OUTPUT_TAIL_LINES = 50
+OUTPUT_MAX_LINE = 4096  # bytes; longer lines are cut
+
+# Default concurrency limits for parallel deploys (overridable via "deploy" in nodes.json)
+DEFAULT_DEPLOY_LIMITS = {
+    "jobs": 0,  # nodes in flight at once (0 = unlimited)
+    "build": 1,  # per-node local builds (nix parallelises inside each build)
+    "transfer": 4,  # closure pushes to remotes (-L)
+    "activate": 8,  # remote switches (fetch from cache + activate)
+    "pve": 2,  # boosted rebuilds per Proxmox host
+}
+
+# Extra resources added to LXC containers during rebuild (until a peak is recorded)
 REBUILD_RAM_BOOST = 4096  # MiB
 REBUILD_CPU_BOOST = 2     # cores
 
+# Remote garbage collection (--gc=auto): collect only when free space on /nix is
+# below max(GC_MIN_FREE, GC_MIN_FREE_FRACTION of the disk), freeing up to twice that
+GC_MIN_FREE = 5 * 1024  # MiB
+GC_MIN_FREE_FRACTION = 0.15
+GC_KEEP_GENERATIONS = 3  # system generations kept for rollback
+
+# Once a container's rebuild peak is known, it is boosted to peak * margin in total
+BOOST_MARGIN = 1.5
+BOOST_SAMPLE_INTERVAL = 5  # seconds between memory samples during a rebuild
+
+# --mode=auto: where remotes fetch from, how much is sent to measure a link, and
+# how much faster than a cache fetch a push must look before it is preferred
+BINARY_CACHE_URL = "@binaryCacheUrl@"  # cache the post-build hook uploads to (shared/binary-cache.nix)
+MODE_PROBE_BYTES = 8 * 1024 * 1024
+MODE_PUSH_ADVANTAGE = 1.5
+MODE_LAN_THROUGHPUT = 30 * 1024 * 1024  # bytes/s; push without a fetch measurement above this
+
+# Cache completeness check before activation: concurrent narinfo lookups (one
+# keep-alive connection each), how long a hit is trusted, parallel uploads
+NARINFO_CONCURRENCY = 16
+NARINFO_HIT_TTL = 7 * 24 * 3600  # seconds
+CACHE_UPLOAD_JOBS = 4
+
+# --fan-out: how many siblings each node copies to in its site's copy tree
+FANOUT_WIDTH = 2
+
+# Builds a remote build host (nodes.json buildHost) runs at once: one per this many cores
+BUILD_CORES_PER_JOB = 4
+
+# Transient SSH failures (see is_transient_error) are retried per (node, host)
+# with exponential backoff and jitter. After CIRCUIT_BREAKER_THRESHOLD connection
+# failures in a row a host is given up on for the rest of the run.
+SSH_RETRIES = 2
+SSH_RETRY_BASE_DELAY = 2  # seconds, doubled per retry
+SSH_RETRY_MAX_DELAY = 30  # seconds
+CIRCUIT_BREAKER_THRESHOLD = 4
+
+
+class JsonState:
+    """A small JSON file, read on first use and rewritten atomically on every save.
+
+    Subclasses set `label` to warn when the file cannot be written; without
+    one, saving is best-effort and failures are silent.
+    """
+
+    label: str | None = None
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.data: dict | None = None
+
+    def _load(self) -> dict:
+        if self.data is None:
+            try:
+                with open(self.path) as f:
+                    self.data = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                self.data = {}
+        return self.data
+
+    def _save(self) -> None:
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self._load(), f, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            if self.label:
+                print(f"{YELLOW}[ ! ]{NC} Could not save {self.label} to {self.path}: {e}")
+
+
+class ReachabilityCache(JsonState):
+    """Small on-disk cache of which targetHost last worked for each node.
+
+    Stores the winning host and its RTT per node, plus the Tailscale backend
+    state, each with a timestamp so stale entries are ignored after their TTL.
+    Written atomically on every update (the file is tiny).
+    """
+
+    def _load(self) -> dict:
+        data = super()._load()
+        data.setdefault("hosts", {})
+        return data
+
+    def get_host(self, node_name: str) -> str | None:
+        """Return the last working host for a node if recorded within REACHABILITY_TTL."""
+        entry = self._load()["hosts"].get(node_name)
+        if entry and time.time() - entry.get("checked", 0) < REACHABILITY_TTL:
+            return entry.get("host")
+        return None
+
+    def record_host(self, node_name: str, host: str, rtt: float) -> None:
+        self._load()["hosts"][node_name] = {"host": host, "rtt": round(rtt, 3), "checked": time.time()}
+        self._save()
+
+    def get_tailscale_state(self) -> str | None:
+        """Return the cached Tailscale BackendState if recorded within TAILSCALE_STATE_TTL."""
+        entry = self._load().get("tailscale")
+        if entry and time.time() - entry.get("checked", 0) < TAILSCALE_STATE_TTL:
+            return entry.get("state")
+        return None
+
+    def record_tailscale_state(self, state: str) -> None:
+        self._load()["tailscale"] = {"state": state, "checked": time.time()}
+        self._save()
+
+    def get_throughput(self, target_host: str, direction: str) -> float | None:
+        """Return a host's measured bytes/s ("push" or "fetch") if recorded within REACHABILITY_TTL."""
+        entry = self._load().get("throughput", {}).get(f"{direction}:{target_host}")
+        if entry and time.time() - entry.get("checked", 0) < REACHABILITY_TTL:
+            return entry.get("bps")
+        return None
+
+    def record_throughput(self, target_host: str, direction: str, bps: float) -> None:
+        self._load().setdefault("throughput", {})[f"{direction}:{target_host}"] = {
+            "bps": round(bps), "checked": time.time()
+        }
+        self._save()
+
+    def clear(self) -> None:
+        self.data = None
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+REACHABILITY = ReachabilityCache(REACHABILITY_CACHE_PATH)
+
+
+class DeployHistory:
+    """SQLite store of per-node, per-phase durations and outcomes.
+
+    Every timed phase of every run is appended, so the scheduler can start
+    the slowest nodes first and the dry run can predict how long a plan takes.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.conn: sqlite3.Connection | None = None
+
+    def _connect(self) -> sqlite3.Connection | None:
+        if self.conn is None:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self.conn = sqlite3.connect(self.path)
+                self.conn.execute(
+                    "CREATE TABLE IF NOT EXISTS phases ("
+                    " node TEXT NOT NULL, phase TEXT NOT NULL, duration REAL NOT NULL,"
+                    " success INTEGER NOT NULL, recorded REAL NOT NULL)"
+                )
+                self.conn.execute("CREATE INDEX IF NOT EXISTS phases_node ON phases (node, phase)")
+                self.conn.execute(
+                    "CREATE TABLE IF NOT EXISTS memory_peaks ("
+                    " node TEXT NOT NULL, peak INTEGER NOT NULL, recorded REAL NOT NULL)"
+                )
+                self.conn.execute(
+                    "CREATE TABLE IF NOT EXISTS narinfo_hits (hash TEXT PRIMARY KEY, checked REAL NOT NULL)"
+                )
+            except sqlite3.Error:
+                self.conn = None
+        return self.conn
+
+    def record(self, node_name: str, phase: str, duration: float, success: bool) -> None:
+        conn = self._connect()
+        if conn is None:
+            return
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT INTO phases VALUES (?, ?, ?, ?, ?)",
+                    (node_name, phase, duration, int(success), time.time()),
+                )
+        except sqlite3.Error:
+            pass  # History is best-effort
+
+    def predict(self, node_name: str, phase: str = "total") -> float | None:
+        """Average duration of the node's last HISTORY_SAMPLES successful runs of a phase."""
+        conn = self._connect()
+        if conn is None:
+            return None
+        try:
+            rows = conn.execute(
+                "SELECT duration FROM phases WHERE node = ? AND phase = ? AND success = 1"
+                " ORDER BY recorded DESC LIMIT ?",
+                (node_name, phase, HISTORY_SAMPLES),
+            ).fetchall()
+        except sqlite3.Error:
+            return None
+        return sum(row[0] for row in rows) / len(rows) if rows else None
+
+    def record_peak(self, node_name: str, peak_mib: int) -> None:
+        """Record a container's peak memory use (MiB) during a rebuild."""
+        conn = self._connect()
+        if conn is None:
+            return
+        try:
+            with conn:
+                conn.execute("INSERT INTO memory_peaks VALUES (?, ?, ?)", (node_name, peak_mib, time.time()))
+        except sqlite3.Error:
+            pass
+
+    def peak_memory(self, node_name: str) -> int | None:
+        """Highest rebuild memory peak (MiB) over the node's last HISTORY_SAMPLES rebuilds."""
+        conn = self._connect()
+        if conn is None:
+            return None
+        try:
+            rows = conn.execute(
+                "SELECT peak FROM memory_peaks WHERE node = ? ORDER BY recorded DESC LIMIT ?",
+                (node_name, HISTORY_SAMPLES),
+            ).fetchall()
+        except sqlite3.Error:
+            return None
+        return max(row[0] for row in rows) if rows else None
+
+    def narinfo_hits(self) -> set[str]:
+        """Store path hashes seen in the binary cache within NARINFO_HIT_TTL."""
+        conn = self._connect()
+        if conn is None:
+            return set()
+        try:
+            rows = conn.execute(
+                "SELECT hash FROM narinfo_hits WHERE checked > ?", (time.time() - NARINFO_HIT_TTL,)
+            ).fetchall()
+        except sqlite3.Error:
+            return set()
+        return {row[0] for row in rows}
+
+    def record_narinfo_hits(self, hashes: list[str]) -> None:
+        """Remember store path hashes found in (or uploaded to) the binary cache."""
+        conn = self._connect()
+        if conn is None or not hashes:
+            return
+        now = time.time()
+        try:
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO narinfo_hits VALUES (?, ?)", [(h, now) for h in hashes])
+                conn.execute("DELETE FROM narinfo_hits WHERE checked <= ?", (now - NARINFO_HIT_TTL,))
+        except sqlite3.Error:
+            pass
+
+
+HISTORY = DeployHistory(HISTORY_DB_PATH)
+
+
+class StagedDeploys(JsonState):
+    """On-disk record of toplevels staged on remotes by --stage, awaiting --switch."""
+
+    label = "staged deploys"
+
+    def get(self, node_name: str) -> dict | None:
+        """The node's staged entry: {"host", "outPath", "staged"} or None."""
+        return self._load().get(node_name)
+
+    def names(self) -> list[str]:
+        return list(self._load())
+
+    def record(self, node_name: str, host: str, out_path: str) -> None:
+        self._load()[node_name] = {"host": host, "outPath": out_path, "staged": time.time()}
+        self._save()
+
+    def remove(self, node_name: str) -> None:
+        if self._load().pop(node_name, None) is not None:
+            self._save()
+
+
+STAGED = StagedDeploys(STAGED_PATH)
+
+
+class DeployJournal(JsonState):
+    """On-disk journal of the current deploy run, for --resume.
+
+    Every node's state (pending, running, done, failed, unchanged) and the
+    phase it is in are written through on each transition, so a run that
+    is interrupted (Ctrl-C, lid closed, network gone) leaves a record of
+    what still has to be deployed. LXC boosts are journalled until they
+    are restored; they survive new runs, which restore any left in place
+    by a run that is no longer alive. Each run keeps its boosts in a file
+    of its own (boosts/<pid>.json next to the journal), so concurrent runs
+    never overwrite each other's records.
+    """
+
+    label = "the deploy journal"
+
+    def __init__(self, path: str) -> None:
+        super().__init__(path)
+        self.active = False
+        self.boost_dir = os.path.join(os.path.dirname(path), "boosts")
+
+    def _boosts(self, pid: int) -> JsonState:
+        """The boosts journalled by the run with this PID."""
+        return JsonState(os.path.join(self.boost_dir, f"{pid}.json"))
+
+    @staticmethod
+    def _alive(pid: int) -> bool:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def begin(self, node_names: list[str]) -> None:
+        """Start a new journal with every node pending (journalled boosts are kept)."""
+        data = self._load()
+        now = time.time()
+        data.update({
+            "pid": os.getpid(),
+            "started": now,
+            "nodes": {name: {"state": "pending", "phase": None, "updated": now} for name in node_names},
+        })
+        self.active = True
+        self._save()
+
+    def resume(self) -> None:
+        """Continue the journalled run in this process."""
+        self._load()["pid"] = os.getpid()
+        self.active = True
+        self._save()
+
+    def resumable(self) -> list[str]:
+        """Nodes the journalled run did not finish: pending, interrupted or failed."""
+        nodes = self._load().get("nodes", {})
+        return [name for name, entry in nodes.items() if entry["state"] not in ("done", "unchanged")]
+
+    def running_elsewhere(self) -> int | None:
+        """PID of another live rebuild writing this journal, if any."""
+        pid = self._load().get("pid")
+        if pid and pid != os.getpid() and self._alive(pid):
+            return pid
+        return None
+
+    def _entry(self, node_name: str) -> dict | None:
+        return self._load().get("nodes", {}).get(node_name) if self.active else None
+
+    def phase(self, node_name: str, phase: str) -> None:
+        entry = self._entry(node_name)
+        # Phases after the node's deploy (e.g. the deferred GC) don't reopen it
+        if entry is None or entry["state"] in ("done", "unchanged"):
+            return
+        entry.update(state="running", phase=phase, updated=time.time())
+        self._save()
+
+    def finish_node(self, node_name: str, state: str) -> None:
+        """Mark a node "done", "failed" or "unchanged"."""
+        if (entry := self._entry(node_name)) is not None:
+            entry.update(state=state, updated=time.time())
+            self._save()
+
+    def record_boost(self, node_name: str, pve_node: str, vmid: int, memory: int, cores: int) -> None:
+        """Journal a boosted LXC's original resources until restore_boost()."""
+        boosts = self._boosts(os.getpid())
+        boosts._load()[node_name] = {"pveNode": pve_node, "vmid": vmid, "memory": memory, "cores": cores}
+        boosts._save()
+
+    def restore_boost(self, node_name: str, pid: int | None = None) -> None:
+        """Drop a boost once restored (journalled by this run, or by the run `pid`)."""
+        boosts = self._boosts(pid or os.getpid())
+        remaining = boosts._load()
+        if remaining.pop(node_name, None) is None:
+            return
+        if remaining:
+            boosts._save()
+        else:
+            try:
+                os.remove(boosts.path)
+            except OSError:
+                pass
+
+    def leftover_boosts(self) -> dict[str, dict]:
+        """Boosts journalled by rebuilds that are no longer running (each with its run's "pid")."""
+        try:
+            file_names = os.listdir(self.boost_dir)
+        except OSError:
+            return {}
+        leftovers = {}
+        for file_name in file_names:
+            pid = file_name.removesuffix(".json")
+            if not pid.isdigit() or int(pid) == os.getpid() or self._alive(int(pid)):
+                continue
+            for name, boost in self._boosts(int(pid))._load().items():
+                leftovers[name] = {**boost, "pid": int(pid)}
+        return leftovers
+
+
+JOURNAL = DeployJournal(JOURNAL_PATH)
+
+
+class PhaseTimings:
+    """Per-run record of every timed phase, for --timings and --events-file.
+
+    Each finished phase is kept in memory for the end-of-run table and, if an
+    events file is open, appended to it as one JSON line so runs can be graphed.
+    """
+
+    # Column order for the --timings table (others are appended after these)
+    PHASE_ORDER = [
+        "eval", "batch-build", "probe", "prepare", "prebuild", "cache-check", "boost",
+        "git-pull", "ship-source", "fan-out", "activate", "transfer", "local-switch", "restore",
+        "cleanup", "total", "stage", "switch", "gc",
+    ]
+
+    def __init__(self) -> None:
+        self.run_id = time.strftime("%Y%m%dT%H%M%S")
+        self.started = time.monotonic()
+        self.phases: list[dict] = []
+        self.events_file = None
+
+    def open_events_file(self, path: str) -> None:
+        self.events_file = open(os.path.expanduser(path), "a")
+
+    def record(self, node_name: str, phase: str, start: float, duration: float, success: bool) -> None:
+        event = {
+            "run": self.run_id,
+            "time": round(time.time(), 3),
+            "node": node_name,
+            "phase": phase,
+            "offset": round(start - self.started, 3),
+            "duration": round(duration, 3),
+            "success": success,
+        }
+        self.phases.append(event)
+        if self.events_file is not None:
+            self.events_file.write(json.dumps(event) + "\n")
+            self.events_file.flush()
+
+    def close(self) -> None:
+        if self.events_file is not None:
+            self.events_file.close()
+            self.events_file = None
+
+    def print_table(self) -> None:
+        """Print seconds spent per node and phase (repeated phases are summed)."""
+        if not self.phases:
+            return
+        totals: dict[str, dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        failed: set[tuple[str, str]] = set()
+        for event in self.phases:
+            totals[event["node"]][event["phase"]] += event["duration"]
+            if not event["success"]:
+                failed.add((event["node"], event["phase"]))
+        seen = {event["phase"] for event in self.phases}
+        columns = [p for p in self.PHASE_ORDER if p in seen] + sorted(seen - set(self.PHASE_ORDER))
+        width = max(len(name) for name in totals) + 2
+
+        print()
+        print(f"{BLUE}[ * ]{NC} {BOLD}Timings (seconds, ! = failed):{NC}")
+        print("  " + "node".ljust(width) + "".join(c.rjust(max(len(c), 7) + 2) for c in columns))
+        for name, phases in totals.items():
+            cells = []
+            for column in columns:
+                cell = f"{phases[column]:.1f}" if column in phases else "-"
+                if (name, column) in failed:
+                    cell += "!"
+                cells.append(cell.rjust(max(len(column), 7) + 2))
+            print("  " + name.ljust(width) + "".join(cells))
+
+
+TIMINGS = PhaseTimings()
+
+
+@contextmanager
+def timed_phase(node_name: str, phase: str):
+    """Time a deploy phase and record it in the history and the run's timings.
+
+    Uses a monotonic clock. Yields a dict; set its "success" key to False
+    when the phase failed without raising. Exceptions (including
+    cancellation) count as failures. Time set in its "waited" key was spent
+    queued behind other nodes: the history records it as a separate
+    "queued" phase and only the rest as the phase's own duration.
+    """
+    outcome = {"success": True}
+    start = time.monotonic()
+    if phase != "total":
+        JOURNAL.phase(node_name, phase)
+    try:
+        yield outcome
+    except BaseException:
+        outcome["success"] = False
+        raise
+    finally:
+        duration = time.monotonic() - start
+        waited = min(outcome.get("waited", 0.0), duration)
+        HISTORY.record(node_name, phase, duration - waited, outcome["success"])
+        if waited:
+            HISTORY.record(node_name, "queued", waited, outcome["success"])
+        TIMINGS.record(node_name, phase, start, duration, outcome["success"])
+
+
+def format_duration(seconds: float) -> str:
+    """Format seconds as e.g. 42.0s or 3m05s."""
+    if seconds < 60:
+        return f"{seconds:.1f}s"
+    minutes, secs = divmod(int(round(seconds)), 60)
+    return f"{minutes}m{secs:02d}s"
+
+
+def format_size(size: float) -> str:
+    """Format a byte count as e.g. 512KiB, 3.4MiB or 1.2GiB."""
+    if size < 1024 * 1024:
+        return f"{size / 1024:.0f}KiB"
+    if size < 1024 ** 3:
+        return f"{size / 1024 ** 2:.1f}MiB"
+    return f"{size / 1024 ** 3:.1f}GiB"
+
 
 def find_tailscale_binary() -> str | None:
     """Find the tailscale binary on the system.
@@ -91,8 +666,13 @@ def is_tailscale_connected() -> bool:
     """Check if Tailscale is connected.
 
     Uses `tailscale status --json` to check if BackendState is "Running".
+    The state is cached on disk for TAILSCALE_STATE_TTL seconds.
     Returns False if tailscale is not installed or not running.
     """
+    cached_state = REACHABILITY.get_tailscale_state()
+    if cached_state is not None:
+        return cached_state == "Running"
+
     tailscale = find_tailscale_binary()
     if not tailscale:
         return False
@@ -107,11 +687,13 @@ def is_tailscale_connected() -> bool:
         if result.returncode != 0:
             return False
 
-        status = json.loads(result.stdout)
-        return status.get("BackendState") == "Running"
+        state = json.loads(result.stdout).get("BackendState", "")
     except (subprocess.TimeoutExpired, subprocess.SubprocessError, json.JSONDecodeError):
         return False
 
+    REACHABILITY.record_tailscale_state(state)
+    return state == "Running"
+
 
 def is_tailscale_ip(host: str) -> bool:
     """Check if a host is a Tailscale IP address (100.64.0.0/10 CGNAT range).
@@ -163,6 +745,7 @@ class Node:
     ssh_port: int  # SSH port (default: 22)
     user: str | None = None  # SSH user override (prepended to target_hosts)
     pve_node: str | None = None  # Proxmox VE node (e.g., "pve1") for LXC RAM boost
+    rebuild_boost: dict | bool | None = None  # nodes.json override: {"memory": MiB, "cores": N}, false or true (default)
 
 
 def load_node_config() -> dict:
@@ -172,7 +755,8 @@ def load_node_config() -> dict:
     to add computed fields (tags, buildHost defaults).
 
     Returns:
-        Dictionary with 'nodes' key containing processed node configs
+        Dictionary with 'nodes' key containing processed node configs and
+        'deploy' key with optional deploy settings (concurrency limits)
     """
     with open(NODES_JSON_PATH) as f:
         raw_config = json.load(f)
@@ -196,9 +780,18 @@ def load_node_config() -> dict:
             "sshPort": cfg.get("sshPort", 22),
             "user": user,
             "pveNode": cfg.get("pveNode"),
+            "rebuildBoost": cfg.get("rebuildBoost"),
         }
 
-    return {"nodes": nodes}
+    return {"nodes": nodes, "deploy": raw_config.get("deploy", {})}
+
+
+def order_by_reachability(node_name: str, hosts: list[str]) -> list[str]:
+    """Move the node's cached last working host (if still fresh) to the front."""
+    cached_host = REACHABILITY.get_host(node_name)
+    if cached_host in hosts:
+        return [cached_host] + [h for h in hosts if h != cached_host]
+    return hosts
 
 
 def get_nodes(tailscale_up: bool = True) -> dict[str, Node]:
@@ -209,7 +802,8 @@ def get_nodes(tailscale_up: bool = True) -> dict[str, Node]:
                       are filtered from target_hosts.
 
     Returns:
-        Dictionary of node name to Node object
+        Dictionary of node name to Node object. Each node's target_hosts
+        starts with its cached last working host, if any.
     """
     node_config = load_node_config()
     return {
@@ -218,35 +812,185 @@ def get_nodes(tailscale_up: bool = True) -> dict[str, Node]:
             type=cfg["type"],
             role=cfg["role"],
             tags=cfg["tags"],
-            target_hosts=filter_tailscale_ips(cfg["targetHosts"], tailscale_up),
+            target_hosts=order_by_reachability(
+                name, filter_tailscale_ips(cfg["targetHosts"], tailscale_up)
+            ),
             build_host=cfg["buildHost"],
             ssh_port=cfg.get("sshPort", 22),
             user=cfg.get("user"),
             pve_node=cfg.get("pveNode"),
+            rebuild_boost=cfg.get("rebuildBoost"),
         )
         for name, cfg in node_config["nodes"].items()
     }
 
 
-def get_current_host() -> str:
+_current_host: str | None = None
+
+
+def kill_process(proc: asyncio.subprocess.Process) -> None:
+    """Kill a subprocess if it is still running (ignores already-exited processes)."""
+    if proc.returncode is None:
+        try:
+            proc.kill()
+        except ProcessLookupError:
+            pass
+
+
+async def run_command(
+    cmd: list[str],
+    timeout: float | None = None,
+    env: dict[str, str] | None = None,
+    merge_stderr: bool = True,
+    input: bytes | None = None,
+) -> tuple[int, str]:
+    """Run a command without blocking the event loop.
+
+    The process is killed if it exceeds `timeout` or if the awaiting task is
+    cancelled, so abandoned probes never outlive the coroutine that started them.
+
+    Args:
+        cmd: Command and arguments
+        timeout: Seconds before the process is killed (None = no limit)
+        env: Environment for the process (default: inherit)
+        merge_stderr: Capture stderr into the output; otherwise discard it
+        input: Bytes written to the process's stdin (default: inherit stdin)
+
+    Returns:
+        Tuple of (returncode, output). returncode is -1 if the command could
+        not be started or timed out.
+    """
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.PIPE if input is not None else None,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT if merge_stderr else asyncio.subprocess.DEVNULL,
+            env=env,
+        )
+    except OSError as e:
+        return -1, str(e)
+
+    try:
+        stdout, _ = await asyncio.wait_for(proc.communicate(input), timeout)
+    except asyncio.TimeoutError:
+        kill_process(proc)
+        await proc.wait()
+        return -1, f"{cmd[0]}: timed out after {timeout}s"
+    except asyncio.CancelledError:
+        kill_process(proc)
+        await proc.wait()
+        raise
+    return proc.returncode, stdout.decode(errors="replace")
+
+
+class OutputTail:
+    """Bounded, streaming capture of a command's output.
+
+    Keeps only the last `max_lines` lines, so memory stays flat however chatty
+    a build is, and classifies failures as lines arrive. With `echo_prefix`
+    set, every line is also printed live with that prefix in a single write,
+    so output from parallel nodes interleaves by whole lines only.
+    """
+
+    def __init__(self, echo_prefix: str | None = None, max_lines: int = OUTPUT_TAIL_LINES) -> None:
+        self.lines: deque[str] = deque(maxlen=max_lines)
+        self.echo_prefix = echo_prefix
+        self.connection_error = False
+
+    def feed(self, text: str) -> None:
+        """Add one or more complete lines (without the trailing newline)."""
+        if not self.connection_error and is_connection_error(text):
+            self.connection_error = True
+        if self.echo_prefix is not None:
+            lines = [line.rstrip("\r") for line in text.split("\n")]
+            sys.stdout.write("".join(f"{self.echo_prefix}{line}\n" for line in lines))
+            sys.stdout.flush()
+        else:
+            # Only the block's last lines can survive in the tail
+            lines = [line.rstrip("\r") for line in text.rsplit("\n", self.lines.maxlen)]
+        self.lines.extend(lines)
+
+    async def consume(self, stream: asyncio.StreamReader) -> None:
+        """Read `stream` to EOF, feeding it a block of whole lines at a time."""
+        partial = b""
+        while chunk := await stream.read(64 * 1024):
+            complete, newline, partial = (partial + chunk).rpartition(b"\n")
+            if newline:
+                self.feed(complete.decode(errors="replace"))
+            if len(partial) > OUTPUT_MAX_LINE:
+                # Never buffer an unbounded line; emit it cut short
+                self.feed(partial[:OUTPUT_MAX_LINE].decode(errors="replace") + " [...]")
+                partial = b""
+        if partial:
+            self.feed(partial.decode(errors="replace"))
+
+    def last(self, count: int) -> list[str]:
+        """The last `count` non-empty lines."""
+        return [line for line in self.lines if line.strip()][-count:]
+
+    @property
+    def text(self) -> str:
+        return "\n".join(self.lines)
+
+
+async def run_deploy_command(
+    cmd: list[str],
+    env: dict[str, str] | None = None,
+    prefix: str = "",
+) -> tuple[bool, OutputTail]:
+    """Run a build/deploy command, keeping a bounded tail of its output.
+
+    With -v the output is also shown live: inherited as-is for a single
+    node, or multiplexed line by line behind `prefix` (e.g. "[node] ") when
+    several nodes deploy in parallel.
+
+    Returns:
+        Tuple of (success, output tail). The tail is empty when the output
+        was inherited.
+    """
+    tail = OutputTail(echo_prefix=prefix if VERBOSE and prefix else None)
+    inherit = VERBOSE and not prefix
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=None if inherit else asyncio.subprocess.PIPE,
+            stderr=None if inherit else asyncio.subprocess.STDOUT,
+            env=env,
+        )
+    except OSError as e:
+        tail.feed(str(e))
+        return False, tail
+
+    try:
+        if proc.stdout:
+            await tail.consume(proc.stdout)
+        await proc.wait()
+    except asyncio.CancelledError:
+        kill_process(proc)
+        await proc.wait()
+        raise
+    return proc.returncode == 0, tail
+
+
+async def get_current_host() -> str:
     """Get the current machine's hostname (short form, lowercase).
 
     On macOS, uses scutil --get ComputerName which returns the nix-darwin
     configured name, as socket.gethostname() may return a different value
     (the DNS hostname rather than the machine name).
+
+    The result is cached for the rest of the run.
     """
+    global _current_host
+    if _current_host is not None:
+        return _current_host
+
     # Try macOS-specific method first (scutil --get ComputerName)
-    try:
-        result = subprocess.run(
-            ["scutil", "--get", "ComputerName"],
-            capture_output=True,
-            text=True,
-            timeout=5,
-        )
-        if result.returncode == 0 and result.stdout.strip():
-            return result.stdout.strip().lower()
-    except (subprocess.TimeoutExpired, FileNotFoundError, subprocess.SubprocessError):
-        pass
+    rc, output = await run_command(["scutil", "--get", "ComputerName"], timeout=5, merge_stderr=False)
+    if rc == 0 and output.strip():
+        _current_host = output.strip().lower()
+        return _current_host
 
     # Fall back to socket.gethostname() for NixOS and other systems
     hostname = socket.gethostname().split(".")[0].lower()
@@ -254,12 +998,13 @@ def get_current_host() -> str:
     for suffix in [".local", ".hyades.io"]:
         if hostname.endswith(suffix):
             hostname = hostname[: -len(suffix)]
-    return hostname
+    _current_host = hostname
+    return _current_host
 
 
-def is_local_deploy(node: Node) -> bool:
+async def is_local_deploy(node: Node) -> bool:
     """Check if deployment target is the current machine."""
-    current = get_current_host()
+    current = await get_current_host()
     return current == node.name
 
 
@@ -288,7 +1033,7 @@ def decrypt_cache_key() -> None:
             )
 
 
-def check_remote_prepared(target_host: str) -> bool:
+async def check_remote_prepared(target_host: str, port: int = 22) -> bool | None:
     """
     Check if a remote host has the required files for nix deployment.
 
@@ -298,24 +1043,24 @@ def check_remote_prepared(target_host: str) -> bool:
 
     Uses SSH config for connection settings (port, identity, etc.)
 
-    Returns True if remote is prepared, False otherwise.
+    Returns True if remote is prepared, False otherwise, None if ssh could
+    not connect.
     """
-    try:
-        result = subprocess.run(
-            [
-                "ssh", "-o", "BatchMode=yes", "-o", "ConnectTimeout=5",
-                target_host,
-                "test -f ~/.age/age.pem && test -d ~/.config/nix/config/"
-            ],
-            capture_output=True,
-            timeout=15,
-        )
-        return result.returncode == 0
-    except (subprocess.TimeoutExpired, subprocess.SubprocessError):
-        return False
+    rc, _ = await run_command(
+        ssh_command(
+            target_host,
+            "test -f ~/.age/age.pem && test -d ~/.config/nix/config/",
+            "-o", "BatchMode=yes", "-o", "ConnectTimeout=5",
+            port=port,
+        ),
+        timeout=15,
+    )
+    if rc == 255:
+        return None
+    return rc == 0
 
 
-def prepare_remote(target_host: str) -> bool:
+async def prepare_remote(target_host: str) -> bool:
     """
     Run nix-remote-setup to prepare a remote host for deployment.
 
@@ -325,44 +1070,186 @@ def prepare_remote(target_host: str) -> bool:
     """
     print(f"{BLUE}[ * ]{NC} Running nix-remote-setup for {target_host}...")
     try:
-        result = subprocess.run(
-            [NIX_REMOTE_SETUP, target_host],
-            check=False,
-        )
-        if result.returncode == 0:
-            print(f"{GREEN}[ ✓ ]{NC} Remote setup completed for {target_host}")
-            return True
-        else:
-            print(f"{RED}[ ✗ ]{NC} Remote setup failed for {target_host}")
-            return False
+        proc = await asyncio.create_subprocess_exec(NIX_REMOTE_SETUP, target_host)
     except FileNotFoundError:
         print(f"{RED}[ ✗ ]{NC} nix-remote-setup not found at {NIX_REMOTE_SETUP}")
         return False
-    except subprocess.SubprocessError as e:
+    except OSError as e:
         print(f"{RED}[ ✗ ]{NC} Failed to run nix-remote-setup: {e}")
         return False
 
+    try:
+        await proc.wait()
+    except asyncio.CancelledError:
+        kill_process(proc)
+        raise
+
+    if proc.returncode == 0:
+        print(f"{GREEN}[ ✓ ]{NC} Remote setup completed for {target_host}")
+        return True
+    else:
+        print(f"{RED}[ ✗ ]{NC} Remote setup failed for {target_host}")
+        return False
+
 
-def ensure_remote_prepared(node: Node) -> bool:
+async def ensure_remote_prepared(node: Node, log_prefix: str = "") -> bool:
     """
     Ensure a remote node is prepared for deployment.
 
-    Checks each target host and runs nix-remote-setup if needed.
+    Checks each target host and runs nix-remote-setup if needed. Hosts
+    that cannot be reached are skipped rather than set up.
     Returns True if at least one host is prepared/preparable.
     """
-    for target_host in node.target_hosts:
-        if check_remote_prepared(target_host):
+    for i, target_host in enumerate(node.target_hosts):
+        if RETRIES.is_open(target_host):
+            continue
+
+        async def check() -> tuple[bool, bool | None]:
+            prepared = await check_remote_prepared(target_host, node.ssh_port)
+            return bool(prepared), prepared
+
+        _, prepared = await RETRIES.run(
+            node, target_host, "prepare", check, lambda prepared: prepared is None,
+            retries=0 if i < len(node.target_hosts) - 1 else None, log_prefix=log_prefix,
+        )
+        if prepared:
             return True
+        if prepared is None:
+            continue
 
         print(f"{YELLOW}[ ! ]{NC} Remote {target_host} is not prepared for deployment")
 
         # Try to prepare it
-        if prepare_remote(target_host):
+        if await prepare_remote(target_host):
             return True
 
     return False
 
 
+def toplevel_attr(node: Node) -> str:
+    """Flake attribute of the node's system closure (what /run/current-system points to)."""
+    if node.type == "darwin":
+        return f"darwinConfigurations.{node.name}.system"
+    return f"nixosConfigurations.{node.name}.config.system.build.toplevel"
+
+
+@dataclass
+class EvalResult:
+    """Outcome of evaluating one node's system closure."""
+    drv_path: str | None = None
+    out_path: str | None = None
+    system: str | None = None  # e.g. x86_64-linux
+    error: str | None = None
+
+
+class EvalEngine:
+    """Evaluates the toplevels of all selected nodes in one place.
+
+    Runs a single nix-eval-jobs over an expression holding every selected
+    node's toplevel. nix-eval-jobs shares the flake evaluation across a
+    bounded pool of worker processes (--workers) and restarts a worker once
+    its RSS crosses --max-memory-size, instead of one full `nix build`
+    evaluation per node all running at once.
+
+    Results stream back as JSON lines, so result() for a node returns as soon
+    as that node's derivation is known and its build can start right away.
+    The evaluation is started lazily on the first result() call.
+    """
+
+    def __init__(self, nodes: list[Node], workers: int, max_rss_mib: int) -> None:
+        self.nodes = {node.name: node for node in nodes}
+        self.workers = workers
+        self.max_rss_mib = max_rss_mib
+        self.results: dict[str, asyncio.Future] = {}
+        self.task: asyncio.Task | None = None
+
+    def _command(self) -> list[str]:
+        attrs = " ".join(
+            f'"{name}" = flake.{toplevel_attr(node)};' for name, node in self.nodes.items()
+        )
+        expr = f'let flake = builtins.getFlake "{FLAKE_PATH}"; in {{ {attrs} }}'
+        return [
+            NIX_EVAL_JOBS,
+            "--impure",
+            "--workers", str(self.workers),
+            "--max-memory-size", str(self.max_rss_mib),
+            "--expr", expr,
+        ]
+
+    def _resolve(self, name: str, result: EvalResult) -> None:
+        future = self.results.get(name)
+        if future is not None and not future.done():
+            future.set_result(result)
+
+    async def _run(self) -> None:
+        with timed_phase("(run)", "eval"):
+            await self._evaluate()
+
+    async def _evaluate(self) -> None:
+        print(
+            f"{BLUE}[ * ]{NC} Evaluating {len(self.nodes)} node(s) "
+            f"({self.workers} worker(s), {self.max_rss_mib}MiB max RSS each)..."
+        )
+        stderr_tail = ""
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *self._command(),
+                stdout=asyncio.subprocess.PIPE,
+                stderr=None if VERBOSE else asyncio.subprocess.PIPE,
+                limit=16 * 1024 * 1024,  # error traces can make very long lines
+            )
+        except OSError as e:
+            stderr_tail = str(e)
+        else:
+            try:
+                stderr = OutputTail(max_lines=10)
+                stderr_task = asyncio.create_task(stderr.consume(proc.stderr)) if proc.stderr else None
+                while line := await proc.stdout.readline():
+                    try:
+                        job = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    name = job.get("attr")
+                    if job.get("error"):
+                        self._resolve(name, EvalResult(error=job["error"].strip()))
+                    else:
+                        self._resolve(name, EvalResult(
+                            drv_path=job.get("drvPath"),
+                            out_path=job.get("outputs", {}).get("out"),
+                            system=job.get("system"),
+                        ))
+                await proc.wait()
+                if stderr_task:
+                    await stderr_task
+                    stderr_tail = stderr.text.strip()
+            except asyncio.CancelledError:
+                kill_process(proc)
+                await proc.wait()
+                raise
+
+        # Anything not reported (evaluator crashed or could not start) failed
+        for name in self.nodes:
+            self._resolve(name, EvalResult(error=stderr_tail or "nix-eval-jobs produced no result"))
+
+    async def result(self, node_name: str) -> EvalResult:
+        """Wait for a node's evaluation (starting the evaluator if needed)."""
+        if self.task is None:
+            loop = asyncio.get_running_loop()
+            self.results = {name: loop.create_future() for name in self.nodes}
+            self.task = asyncio.create_task(self._run())
+        return await self.results[node_name]
+
+    async def close(self) -> None:
+        """Stop the evaluator if it is still running."""
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+
+
+# Evaluator for the selected nodes, set up by run_plan()
+EVALUATOR: EvalEngine | None = None
+
+
 def build_local_command(node: Node) -> list[str]:
     """Build the command for local deployment using nh."""
     nh_type = "darwin" if node.type == "darwin" else "os"
@@ -370,10 +1257,9 @@ def build_local_command(node: Node) -> list[str]:
     return ["nh", nh_type, "switch", "--impure", "-H", node.name, FLAKE_PATH]
 
 
-def build_remote_ssh_command(node: Node, target_host: str) -> list[str]:
-    """Build SSH command to run nixos-rebuild on the remote directly.
+def build_remote_pull_command(node: Node, target_host: str) -> list[str]:
+    """Build SSH command to update the remote's config checkout.
 
-    The remote fetches from its own configured caches (ncps, cache.nixos.org).
     Uses agent forwarding + GIT_SSH_COMMAND to bypass IdentitiesOnly in
     remote's ssh_config for git pull.
     """
@@ -382,13 +1268,33 @@ def build_remote_ssh_command(node: Node, target_host: str) -> list[str]:
         "cd ~/.config/nix/config"
         f" && {git_ssh} git pull --rebase -q"
         f" && {git_ssh} git submodule update --init -q"
-        f" && sudo nixos-rebuild switch --fast --impure --flake .#{node.name}"
     )
-    cmd = ["ssh", "-A", "-o", "StrictHostKeyChecking=accept-new"]
-    if node.ssh_port != 22:
-        cmd.extend(["-p", str(node.ssh_port)])
-    cmd.extend([target_host, remote_cmd])
-    return cmd
+    return ssh_command(
+        target_host, remote_cmd,
+        "-o", "StrictHostKeyChecking=accept-new",
+        port=node.ssh_port, forward_agent=True,
+    )
+
+
+def build_remote_ssh_command(node: Node, target_host: str, source: str | None = None) -> list[str]:
+    """Build SSH command to run nixos-rebuild on the remote directly.
+
+    Rebuilds from the remote's checkout (see build_remote_pull_command), or
+    from a shipped flake source snapshot in the store (--ship-source).
+    The remote fetches from its own configured caches (ncps, cache.nixos.org).
+    """
+    if source:
+        remote_cmd = f"sudo nixos-rebuild switch --fast --impure --flake {source}#{node.name}"
+    else:
+        remote_cmd = (
+            "cd ~/.config/nix/config"
+            f" && sudo nixos-rebuild switch --fast --impure --flake .#{node.name}"
+        )
+    return ssh_command(
+        target_host, remote_cmd,
+        "-o", "StrictHostKeyChecking=accept-new",
+        port=node.ssh_port, forward_agent=True,
+    )
 
 
 def build_local_push_command(node: Node, target_host: str) -> list[str]:
@@ -413,69 +1319,912 @@ def build_local_push_command(node: Node, target_host: str) -> list[str]:
     ]
 
 
-async def prebuild_locally(node: Node, prefix: str = "") -> bool:
-    """Build the system toplevel locally to populate the cache.
-
-    The post-build-hook uploads to NCPS, so after this the remote
-    can fetch everything from cache instead of having it pushed.
+class FlakeSource:
+    """Snapshot of the flake source in the store, shipped to remotes (--ship-source).
 
-    Returns True if the build succeeded.
+    The snapshot is the committed `main` tree including the private/
+    submodule (what remotes would otherwise git pull), taken once per run.
+    Each remote receives it with nix-copy-closure at most once and rebuilds
+    from that exact store path, so every node is pinned to the same revision
+    and the git server is off the hot path. flake.nix picks up private/ from
+    the snapshot itself instead of fetching the remote's checkout.
     """
-    log_prefix = f"[{node.name}] " if prefix else ""
-    print(f"{BLUE}[ * ]{NC} {log_prefix}Pre-building locally (populating cache)...")
 
-    cmd = [
-        "nix", "build",
-        f"{FLAKE_PATH}#nixosConfigurations.{node.name}.config.system.build.toplevel",
-        "--impure", "--no-link",
-    ]
-
-    if VERBOSE:
-        proc = await asyncio.create_subprocess_exec(
-            *cmd, stdout=None, stderr=None,
-        )
-        await proc.wait()
-        return proc.returncode == 0
-    else:
-        proc = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.STDOUT,
-        )
-        stdout, _ = await proc.communicate()
-        if proc.returncode != 0:
-            output = stdout.decode()
-            print(f"{RED}[ ✗ ]{NC} {log_prefix}Local pre-build failed")
-            lines = output.strip().split("\n")
+    def __init__(self) -> None:
+        self.snapshot: asyncio.Task | None = None
+        self.shipped: dict[str, asyncio.Task] = {}
+
+    def prefetch(self) -> None:
+        """Start taking the snapshot in the background."""
+        if self.snapshot is None:
+            self.snapshot = asyncio.create_task(self._take_snapshot())
+
+    async def path(self) -> tuple[str | None, str]:
+        """The snapshot's store path (taken on first use), or (None, error)."""
+        self.prefetch()
+        return await asyncio.shield(self.snapshot)
+
+    async def _take_snapshot(self) -> tuple[str | None, str]:
+        print(f"{BLUE}[ * ]{NC} Snapshotting flake source (main, with submodules) into the store...")
+        expr = f'(builtins.fetchGit {{ url = "file://{FLAKE_PATH}"; submodules = true; ref = "main"; }}).outPath'
+        rc, output = await run_command(["nix", "eval", "--raw", "--impure", "--expr", expr])
+        # The path is printed last, after any warnings
+        lines = output.strip().split("\n")
+        if rc != 0 or not lines[-1].startswith("/nix/store/"):
+            print(f"{RED}[ ✗ ]{NC} Could not snapshot flake source")
             for line in lines[-5:]:
                 print(f"    {line}")
-        return proc.returncode == 0
-
+            return None, output
+        print(f"{GREEN}[ ✓ ]{NC} Flake source: {lines[-1]}")
+        return lines[-1], ""
+
+    async def ship(self, node: Node, target_host: str) -> tuple[str | None, str]:
+        """Make sure the snapshot is on `target_host`.
+
+        Returns:
+            Tuple of (store path, "") or (None, error output). A failed copy
+            is retried by the next caller.
+        """
+        source, error = await self.path()
+        if source is None:
+            return None, error
+        if target_host not in self.shipped:
+            self.shipped[target_host] = asyncio.create_task(self._copy(node, target_host, source))
+        task = self.shipped[target_host]
+        success, output = await asyncio.shield(task)
+        if not success:
+            if self.shipped.get(target_host) is task:
+                del self.shipped[target_host]
+            return None, output
+        return source, ""
+
+    async def _copy(self, node: Node, target_host: str, source: str) -> tuple[bool, str]:
+        success, tail = await run_deploy_command(
+            ["nix-copy-closure", "--to", target_host, source],
+            get_nix_ssh_env(node.ssh_port, target_host),
+        )
+        return success, tail.text
 
-# Global flags
-VERBOSE = False
-LOCAL_BUILD = False
-REMOTE_BUILD = False
 
+FLAKE_SOURCE = FlakeSource()
 
-def get_nix_ssh_env(ssh_port: int) -> dict[str, str]:
-    """Get environment with NIX_SSHOPTS for custom SSH port and host key checking."""
-    env = os.environ.copy()
-    ssh_opts = ["-o", "StrictHostKeyChecking=accept-new"]
-    if ssh_port != 22:
-        ssh_opts.extend(["-p", str(ssh_port)])
-    env["NIX_SSHOPTS"] = " ".join(ssh_opts)
-    return env
 
+# GC root keeping a staged toplevel alive on the remote until it is switched to
+STAGED_GCROOT = "/nix/var/nix/gcroots/rebuild-staged"
 
 
+def build_stage_command(node: Node, target_host: str, out_path: str, source: str | None = None) -> list[str]:
+    """Build SSH command that realises a toplevel on the remote without activating it.
 
-def is_connection_error(output: str) -> bool:
+    The path is fetched from the remote's caches (or was just copied there
+    with -L; with -R it is built from the remote's checkout, or the shipped
+    `source`, first) and pinned with a GC root until --switch.
     """
-    Check if the error output indicates a connection failure vs deployment failure.
+    remote_cmd = f"sudo nix-store --realise {out_path} --add-root {STAGED_GCROOT} > /dev/null"
+    remote_build = deploy_mode(node) == "remote-build"
+    if remote_build and source:
+        remote_cmd = f"sudo nix build --impure --no-link {source}#{toplevel_attr(node)} && {remote_cmd}"
+    elif remote_build:
+        remote_cmd = (
+            "cd ~/.config/nix/config"
+            f" && sudo nix build --impure --no-link .#{toplevel_attr(node)}"
+            f" && {remote_cmd}"
+        )
+    return ssh_command(
+        target_host, remote_cmd,
+        "-o", "StrictHostKeyChecking=accept-new",
+        port=node.ssh_port,
+    )
 
-    Connection failures should trigger fallback to the next host.
-    Deployment failures (build errors, etc.) should not.
+
+def build_switch_command(node: Node, target_host: str, out_path: str) -> list[str]:
+    """Build SSH command that activates an already staged toplevel (what nixos-rebuild switch does)."""
+    remote_cmd = (
+        f"sudo nix-env --profile /nix/var/nix/profiles/system --set {out_path}"
+        f" && sudo {out_path}/bin/switch-to-configuration switch"
+        f" && sudo rm -f {STAGED_GCROOT}"
+    )
+    return ssh_command(
+        target_host, remote_cmd,
+        "-o", "StrictHostKeyChecking=accept-new",
+        port=node.ssh_port,
+    )
+
+
+async def prebuild_locally(node: Node, prefix: str = "") -> bool:
+    """Build the system toplevel locally to populate the cache.
+
+    The post-build-hook uploads to NCPS, so after this the remote
+    can fetch everything from cache instead of having it pushed.
+    A node with a remote buildHost is built there instead (see BuildPool).
+    A build already started ahead of time (see LookaheadBuilds) is awaited
+    instead of starting another one.
+
+    Returns True if the build succeeded.
+    """
+    if LOOKAHEAD is not None and (ahead := LOOKAHEAD.take(node)) is not None:
+        return await ahead
+    return await _prebuild_locally(node, prefix)
+
+
+async def _prebuild_locally(node: Node, prefix: str = "") -> bool:
+    """Build a node's toplevel locally (see prebuild_locally)."""
+    log_prefix = f"[{node.name}] " if prefix else ""
+
+    # Build the derivation the shared evaluator produced instead of
+    # re-evaluating the whole flake for this node
+    installable = f"{FLAKE_PATH}#{toplevel_attr(node)}"
+    if EVALUATOR is not None:
+        evaluated = await EVALUATOR.result(node.name)
+        if evaluated.error:
+            FAILURES.report(node, evaluated.error, log_prefix, "Evaluation failed")
+            return False
+        installable = f"{evaluated.drv_path}^*"
+        if BUILD_POOL is not None and BUILD_POOL.uses_remote(node):
+            if blocker := await FAILURES.blocker(node):
+                FAILURES.skip(node, blocker, log_prefix)
+                return False
+            success = await BUILD_POOL.build(node, evaluated.drv_path, evaluated.system, log_prefix)
+            if success is not None:
+                return success
+
+    start = time.monotonic()
+    if BATCH_BUILD is not None and node.name in BATCH_BUILD.nodes:
+        success, output = await BATCH_BUILD.wait(node.name)
+        # Time until the batch started went to other nodes' evaluations
+        if SCHEDULER is not None and BATCH_BUILD.started is not None and BATCH_BUILD.started > start:
+            SCHEDULER.record_wait(node.name, "batch", BATCH_BUILD.started - start)
+        if not success:
+            # One output for the whole batch: blame the failed derivation in this node's closure
+            FAILURES.note_output(output)
+            FAILURES.report(
+                node, output, log_prefix, "Local pre-build failed (batched build)", await FAILURES.blocker(node)
+            )
+    else:
+        async with phase_slot(node, "build"):
+            # Checked once the slot is ours: queued nodes see failures from builds ahead of them
+            if blocker := await FAILURES.blocker(node):
+                FAILURES.skip(node, blocker, log_prefix)
+                success = False
+            else:
+                success = await run_prebuild(node, installable, log_prefix)
+    if BUILD_POOL is not None:
+        BUILD_POOL.local.built.append((node.name, time.monotonic() - start, success))
+    return success
+
+
+async def run_prebuild(node: Node, installable: str, log_prefix: str) -> bool:
+    """Run a single node's local pre-build of `installable`."""
+    print(f"{BLUE}[ * ]{NC} {log_prefix}Pre-building locally (populating cache)...")
+
+    cmd = ["nix", "build", installable, "--impure", "--no-link"]
+    result = await FAILURES.guard(node, run_deploy_command(cmd, prefix=log_prefix), log_prefix)
+    if result is None:
+        return False
+    success, output = result
+    if not success and not VERBOSE:
+        FAILURES.report(node, output.text, log_prefix, "Local pre-build failed")
+    return success
+
+
+class BatchBuild:
+    """Realises every selected node's toplevel in a single `nix build`.
+
+    One nix process schedules all shared dependencies once instead of several
+    processes competing for the same store locks. The build is started lazily
+    on the first wait(), once every node's evaluation has finished.
+
+    While it runs, the toplevel out-paths are polled for validity. A valid
+    path implies its whole closure is valid, so each node's wait() returns
+    as soon as its own closure is realised, not when the whole batch
+    finishes. --keep-going lets independent nodes finish past a failure, and
+    out-paths still invalid when nix exits map back to failed nodes.
+    """
+
+    def __init__(self, nodes: list[Node]) -> None:
+        self.nodes = {node.name: node for node in nodes}
+        self.results: dict[str, asyncio.Future] = {}
+        self.task: asyncio.Task | None = None
+        self.started: float | None = None  # monotonic time the nix build started
+
+    def _resolve(self, name: str, success: bool, output: str = "") -> None:
+        future = self.results[name]
+        if not future.done():
+            future.set_result((success, output))
+
+    async def _invalid_paths(self, paths: list[str]) -> set[str] | None:
+        """Return which of the given store paths are not (yet) valid, None on error."""
+        rc, output = await run_command(
+            ["nix-store", "--check-validity", "--print-invalid", *paths],
+            merge_stderr=False,
+        )
+        return set(output.split()) if rc == 0 else None
+
+    async def _run(self) -> None:
+        # Wait for all evaluations; nodes that failed to evaluate fail here
+        out_paths = {}
+        drv_paths = []
+        for name in self.nodes:
+            evaluated = await EVALUATOR.result(name)
+            if evaluated.error:
+                self._resolve(name, False, evaluated.error)
+            else:
+                out_paths[evaluated.out_path] = name
+                drv_paths.append(f"{evaluated.drv_path}^*")
+
+        pending = dict(out_paths)
+
+        async def mark_realised() -> None:
+            invalid = await self._invalid_paths(list(pending))
+            if invalid is None:
+                return
+            for path in [p for p in pending if p not in invalid]:
+                self._resolve(pending.pop(path), True)
+
+        if pending:
+            await mark_realised()
+        if not pending:
+            return
+
+        names = ", ".join(pending.values())
+        print(f"{BLUE}[ * ]{NC} Pre-building {len(pending)} node(s) locally in one batch: {BOLD}{names}{NC}")
+        cmd = ["nix", "build", "--no-link", "--keep-going", "--impure", *drv_paths]
+        self.started = time.monotonic()
+        with timed_phase("(run)", "batch-build") as phase:
+            # Shares the terminal with per-node deploys, so -v output is prefixed
+            output = OutputTail(echo_prefix="[batch] " if VERBOSE else None)
+            proc = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+            )
+            output_task = asyncio.create_task(output.consume(proc.stdout))
+            try:
+                while True:
+                    try:
+                        await asyncio.wait_for(asyncio.shield(proc.wait()), BATCH_POLL_INTERVAL)
+                        break
+                    except asyncio.TimeoutError:
+                        await mark_realised()
+                await output_task
+            except asyncio.CancelledError:
+                output_task.cancel()
+                kill_process(proc)
+                await proc.wait()
+                raise
+            phase["success"] = proc.returncode == 0
+
+        await mark_realised()
+        for name in list(pending.values()):
+            self._resolve(name, False, output.text or f"nix build exited with code {proc.returncode}")
+
+    async def wait(self, node_name: str) -> tuple[bool, str]:
+        """Wait until the node's toplevel is realised. Returns (success, error output)."""
+        if self.task is None:
+            loop = asyncio.get_running_loop()
+            self.results = {name: loop.create_future() for name in self.nodes}
+            self.task = asyncio.create_task(self._run())
+        return await self.results[node_name]
+
+    async def close(self) -> None:
+        """Stop the batch build if it is still running."""
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+
+
+# Batched local pre-build for parallel runs, set up by run_plan()
+BATCH_BUILD: BatchBuild | None = None
+
+
+# Failure fingerprints: the derivation whose builder failed, or an
+# evaluation error's innermost source location (store hashes stripped)
+FAILED_DRV_RE = re.compile(r"(?:builder for|Cannot build) '(/nix/store/[^']+\.drv)'")
+EVAL_LOCATION_RE = re.compile(r"\bat (\S+?):(\d+):(\d+)")
+STORE_PREFIX_RE = re.compile(r"/nix/store/[a-z0-9]{32}-")
+
+
+@dataclass
+class Failure:
+    """One distinct build or evaluation failure and the nodes it hit."""
+    summary: str
+    output: list[str]  # last lines of the first occurrence
+    nodes: list[str] = field(default_factory=list)  # failed on it
+    skipped: list[str] = field(default_factory=list)  # never built, their closure contains it
+
+
+class FailureTracker:
+    """Fleet-wide fail fast on shared build and evaluation failures.
+
+    Failures are fingerprinted from their output: a build failure by the
+    derivation whose builder failed, an evaluation error by its innermost
+    source location and message. The first node to hit a failure prints
+    it; later nodes with the same fingerprint print one line. Nodes whose
+    derivation closure contains a failed derivation are skipped when they
+    reach their build, and builds already running for them are cancelled.
+    The summary lists each shared failure once. --keep-going turns all of
+    this off.
+    """
+
+    def __init__(self) -> None:
+        self.failures: dict[str, Failure] = {}
+        self.failed_drvs: dict[str, str] = {}  # failed derivation -> fingerprint
+        self.closures: dict[str, asyncio.Task] = {}  # node name -> its derivation closure
+        self.running: dict[str, tuple[Node, asyncio.Task]] = {}
+        self.cancelled: dict[str, str] = {}  # node name -> failed derivation it needed
+        self.skipped: set[str] = set()
+        self.cancellers: set[asyncio.Task] = set()  # pending _cancel_dependents() runs
+
+    @staticmethod
+    def fingerprint(output: str) -> tuple[str, str] | None:
+        """(fingerprint, one-line summary) of a failure's output, None if unrecognised."""
+        drvs = FAILED_DRV_RE.findall(output)
+        if drvs:
+            # The first failed builder is the cause; later ones are usually its dependents
+            return f"drv:{drvs[0]}", f"builder for {drvs[0]} failed"
+        messages = [line.strip() for line in output.splitlines() if line.strip().startswith("error:")]
+        locations = EVAL_LOCATION_RE.findall(output)
+        if not messages and not locations:
+            return None
+        location = STORE_PREFIX_RE.sub("", ":".join(locations[-1])) if locations else "unknown location"
+        message = messages[-1] if messages else "evaluation failed"
+        return f"eval:{location}:{message}", f"{message} (at {location})"
+
+    async def _closure(self, node: Node) -> set[str]:
+        evaluated = await EVALUATOR.result(node.name)
+        if not evaluated.drv_path:
+            return set()
+        rc, output = await run_command(
+            ["nix-store", "--query", "--requisites", evaluated.drv_path], timeout=120, merge_stderr=False
+        )
+        return set(output.split()) if rc == 0 else set()
+
+    async def closure(self, node: Node) -> set[str]:
+        """The node's derivation closure (queried once, only once something failed)."""
+        if node.name not in self.closures:
+            self.closures[node.name] = asyncio.create_task(self._closure(node))
+        return await asyncio.shield(self.closures[node.name])
+
+    async def blocker(self, node: Node) -> str | None:
+        """A failed derivation the node would have to build, if any."""
+        if KEEP_GOING or not self.failed_drvs or EVALUATOR is None:
+            return None
+        closure = await self.closure(node)
+        return next((drv for drv in self.failed_drvs if drv in closure), None)
+
+    def note_output(self, output: str) -> None:
+        """Register every failed derivation named in a (batched) build's output."""
+        for drv in FAILED_DRV_RE.findall(output):
+            self.failed_drvs.setdefault(drv, f"drv:{drv}")
+
+    def report(
+        self, node: Node, output: str, log_prefix: str, what: str, drv: str | None = None, count: int = 5
+    ) -> None:
+        """Print a node's failure (its last `count` lines), or one line if another node hit it first.
+
+        `drv` pins the fingerprint to that derivation (a batch's output can
+        name several failed builders).
+        """
+        lines = [line for line in output.splitlines() if line.strip()][-count:]
+        found = (f"drv:{drv}", f"builder for {drv} failed") if drv else self.fingerprint(output)
+        if KEEP_GOING or found is None:
+            print(f"{RED}[ ✗ ]{NC} {log_prefix}{what}")
+            for line in lines:
+                print(f"    {line}")
+            return
+        key, summary = found
+        failure = self.failures.get(key)
+        if failure is not None:
+            failure.nodes.append(node.name)
+            print(f"{RED}[ ✗ ]{NC} {log_prefix}{what}: same error as {failure.nodes[0]} ({summary})")
+            return
+        self.failures[key] = Failure(summary, lines, [node.name])
+        print(f"{RED}[ ✗ ]{NC} {log_prefix}{what}")
+        for line in lines:
+            print(f"    {line}")
+        if key.startswith("drv:"):
+            self.failed_drvs[key[4:]] = key
+            task = asyncio.get_running_loop().create_task(self._cancel_dependents(key[4:]))
+            self.cancellers.add(task)
+            task.add_done_callback(self.cancellers.discard)
+
+    def skip(self, node: Node, drv: str, log_prefix: str) -> None:
+        """Record and print that a node was not built because it needs `drv`."""
+        failure = self.failures.setdefault(self.failed_drvs[drv], Failure(f"builder for {drv} failed", []))
+        failure.skipped.append(node.name)
+        self.skipped.add(node.name)
+        first = f" (failed for {failure.nodes[0]})" if failure.nodes else ""
+        print(f"{YELLOW}[ ! ]{NC} {log_prefix}{node.name} - skipped, needs {drv}{first}")
+
+    async def _cancel_dependents(self, drv: str) -> None:
+        for name, (node, task) in list(self.running.items()):
+            if drv in await self.closure(node) and not task.done():
+                self.cancelled[name] = drv
+                task.cancel()
+
+    async def guard(self, node: Node, build, log_prefix: str = ""):
+        """Await a node's build coroutine, cancelling it if a derivation it needs fails elsewhere.
+
+        Returns the coroutine's result, or None (reported as skipped) if it was cancelled.
+        """
+        if KEEP_GOING:
+            return await build
+        task = asyncio.ensure_future(build)
+        self.running[node.name] = (node, task)
+        try:
+            return await task
+        except asyncio.CancelledError:
+            if node.name in self.cancelled and not asyncio.current_task().cancelling():
+                self.skip(node, self.cancelled[node.name], log_prefix)
+                return None
+            raise
+        finally:
+            self.running.pop(node.name, None)
+
+    async def close(self) -> None:
+        """Stop cancellations and closure queries still running."""
+        pending = [task for task in [*self.cancellers, *self.closures.values()] if not task.done()]
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    def print_report(self) -> None:
+        """List every failure that hit (or skipped) more than one node, once."""
+        for failure in self.failures.values():
+            if len(failure.nodes) + len(failure.skipped) < 2:
+                continue
+            count = len(failure.nodes) + len(failure.skipped)
+            print(f"{RED}[ ✗ ]{NC} {count} node(s), one failure: {failure.summary}")
+            if failure.nodes:
+                print(f"    failed: {', '.join(failure.nodes)}")
+            if failure.skipped:
+                print(f"    skipped: {', '.join(failure.skipped)}")
+            for line in failure.output:
+                print(f"    {line}")
+
+
+FAILURES = FailureTracker()
+
+
+@dataclass
+class BuildHost:
+    """A machine that pre-builds toplevels (nodes.json buildHost, or this machine)."""
+    name: str
+    ssh_host: str | None  # None = this machine
+    ssh_port: int = 22
+    cores: int = 1
+    system: str | None = None  # e.g. x86_64-linux
+    in_flight: int = 0
+    built: list[tuple[str, float, bool]] = field(default_factory=list)  # (node, seconds, success)
+
+    @property
+    def slots(self) -> int:
+        return max(1, self.cores // BUILD_CORES_PER_JOB)
+
+    @property
+    def load(self) -> float:
+        """Jobs per core once one more build starts here."""
+        return (self.in_flight + 1) / self.cores
+
+
+class BuildPool:
+    """Spreads the run's pre-builds over its build hosts (nodes.json buildHost).
+
+    A cache-fetch node whose buildHost names another machine is built there
+    (`nix build --store ssh-ng://...`; the derivations are copied over
+    first), and that machine's post-build hook fills the cache the node then
+    fetches from. Nodes without an explicit buildHost keep building here.
+    Each build host runs at most cores / BUILD_CORES_PER_JOB builds at once,
+    and a node goes to the compatible build host of this run with the
+    lowest load (jobs in flight per core), its own buildHost winning ties.
+    """
+
+    def __init__(self, targets: list[Node], nodes: dict[str, Node]) -> None:
+        self.targets = targets
+        self.nodes = nodes
+        self.local = BuildHost("this machine", None, cores=os.cpu_count() or 1)
+        self.probes: dict[str, asyncio.Task] = {}
+        self.built_on: dict[str, BuildHost] = {}  # node name -> remote build host
+        self.changed = asyncio.Condition()
+
+    @staticmethod
+    def remote_host(node: Node) -> str | None:
+        """The node's explicit buildHost, if that is another machine."""
+        return node.build_host if node.build_host and node.build_host != node.name else None
+
+    def uses_remote(self, node: Node) -> bool:
+        return self.remote_host(node) is not None and deploy_mode(node) == "cache-fetch"
+
+    async def _probe(self, name: str) -> BuildHost | None:
+        """Resolve a buildHost (node name or SSH host) and read its cores and Nix system."""
+        node = self.nodes.get(name)
+        if node is not None:
+            ssh_host, _ = await race_target_hosts(node)
+            ssh_port = node.ssh_port
+        else:
+            ssh_host, ssh_port = name, 22
+        rc, output = 1, ""
+        if ssh_host is not None:
+            rc, output = await run_command(
+                ssh_command(
+                    ssh_host, "nproc && nix eval --impure --raw --expr builtins.currentSystem",
+                    "-o", "BatchMode=yes", "-o", "ConnectTimeout=10",
+                    port=ssh_port,
+                ),
+                timeout=30,
+                merge_stderr=False,
+            )
+        lines = output.split()
+        if rc != 0 or len(lines) < 2 or not lines[0].isdigit():
+            print(f"{YELLOW}[ ! ]{NC} Build host {name} unreachable, its nodes build here")
+            return None
+        return BuildHost(name, ssh_host, ssh_port, cores=int(lines[0]), system=lines[1])
+
+    async def host(self, name: str) -> BuildHost | None:
+        if name not in self.probes:
+            self.probes[name] = asyncio.create_task(self._probe(name))
+        return await asyncio.shield(self.probes[name])
+
+    async def acquire(self, node: Node, system: str | None) -> BuildHost | None:
+        """Reserve a slot on the least loaded build host for `node` (None = build here)."""
+        names = {self.remote_host(target) for target in self.targets if self.uses_remote(target)}
+        names.add(self.remote_host(node))
+        candidates = [
+            host for host in await asyncio.gather(*(self.host(name) for name in sorted(names)))
+            if host is not None and (system is None or host.system == system)
+        ]
+        if not candidates:
+            return None
+        own = self.remote_host(node)
+        start = time.monotonic()
+        async with self.changed:
+            await self.changed.wait_for(lambda: any(h.in_flight < h.slots for h in candidates))
+            free = [host for host in candidates if host.in_flight < host.slots]
+            chosen = min(free, key=lambda host: (host.load, host.name != own))
+            chosen.in_flight += 1
+        if SCHEDULER is not None:
+            SCHEDULER.record_wait(node.name, f"build:{chosen.name}", time.monotonic() - start)
+        return chosen
+
+    async def release(self, host: BuildHost) -> None:
+        async with self.changed:
+            host.in_flight -= 1
+            self.changed.notify_all()
+
+    async def build(self, node: Node, drv_path: str, system: str | None, log_prefix: str) -> bool | None:
+        """Build the node's toplevel on a remote build host.
+
+        Returns None if no build host is usable (the caller builds here).
+        """
+        host = await self.acquire(node, system)
+        if host is None:
+            return None
+        start = time.monotonic()
+        try:
+            print(
+                f"{BLUE}[ * ]{NC} {log_prefix}Pre-building on {host.name} "
+                f"({host.in_flight}/{host.slots} job(s), {host.cores} cores)..."
+            )
+            cmd = ["nix", "build", "--store", f"ssh-ng://{host.ssh_host}", "--eval-store", "auto",
+                   "--no-link", f"{drv_path}^*"]
+            result = await FAILURES.guard(
+                node,
+                run_deploy_command(cmd, get_nix_ssh_env(host.ssh_port, host.ssh_host), prefix=log_prefix),
+                log_prefix,
+            )
+        finally:
+            await self.release(host)
+        if result is None:
+            return False
+        success, tail = result
+        host.built.append((node.name, time.monotonic() - start, success))
+        if success:
+            self.built_on[node.name] = host
+        elif not VERBOSE:
+            FAILURES.report(node, tail.text, log_prefix, f"Pre-build on {host.name} failed")
+        return success
+
+    def print_report(self) -> None:
+        """Which machine built which node and how long it took (only if a remote host built)."""
+        hosts = [task.result() for task in self.probes.values() if task.done() and not task.cancelled()]
+        hosts = [host for host in hosts if host is not None and host.built]
+        if not hosts:
+            return
+        print()
+        print(f"{BLUE}[ * ]{NC} {BOLD}Builds:{NC}")
+        for host in [self.local, *hosts]:
+            if host.built:
+                builds = ", ".join(
+                    f"{name} {format_duration(secs)}" + ("" if ok else " (failed)")
+                    for name, secs, ok in host.built
+                )
+                print(f"  {host.name} ({host.cores} cores): {builds}")
+
+
+# Distribution of pre-builds over build hosts, set up by run_plan()
+BUILD_POOL: BuildPool | None = None
+
+
+class CacheCheck:
+    """Makes sure a toplevel's whole closure is in the binary cache before activation.
+
+    The post-build hook only uploads what a build produced, so paths that were
+    already built (or whose upload failed) can be missing, and the remote then
+    builds them or falls through to cache.nixos.org. ensure() looks up each
+    closure path's narinfo with HEAD requests spread over a pool of threads,
+    each holding one keep-alive connection, and uploads only the missing
+    paths in parallel `nix copy` batches. A path is checked once per run
+    however many nodes share it, and hits are remembered in the history
+    database for NARINFO_HIT_TTL.
+    """
+
+    def __init__(self, url: str) -> None:
+        parsed = urllib.parse.urlsplit(url)
+        self.url = url
+        self.https = parsed.scheme == "https"
+        self.netloc = parsed.netloc
+        self.base = parsed.path.rstrip("/")
+        self.checks: dict[str, asyncio.Task] = {}  # store path -> check/upload task covering it
+        self.executor: ThreadPoolExecutor | None = None
+        self.local = threading.local()
+        self.known: set[str] | None = None
+
+    def _connection(self) -> http.client.HTTPConnection:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn_class = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+            conn = self.local.conn = conn_class(self.netloc, timeout=10)
+        return conn
+
+    def _lookup_chunk(self, hashes: list[str]) -> list[bool]:
+        """Blocking: whether each hash has a narinfo, over this thread's connection."""
+        found = []
+        for store_hash in hashes:
+            for _ in range(2):  # a dropped keep-alive connection gets one reconnect
+                conn = self._connection()
+                try:
+                    conn.request("HEAD", f"{self.base}/{store_hash}.narinfo")
+                    response = conn.getresponse()
+                    response.read()
+                    found.append(response.status == 200)
+                    break
+                except (OSError, http.client.HTTPException):
+                    conn.close()
+                    self.local.conn = None
+            else:
+                found.append(False)  # unreachable counts as missing; nix copy skips what's there
+        return found
+
+    async def _lookup(self, hashes: list[str]) -> dict[str, bool]:
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(NARINFO_CONCURRENCY, thread_name_prefix="narinfo")
+        loop = asyncio.get_running_loop()
+        size = max(1, math.ceil(len(hashes) / NARINFO_CONCURRENCY))
+        chunks = [hashes[i:i + size] for i in range(0, len(hashes), size)]
+        results = await asyncio.gather(
+            *(loop.run_in_executor(self.executor, self._lookup_chunk, chunk) for chunk in chunks)
+        )
+        return dict(zip(hashes, [found for chunk in results for found in chunk]))
+
+    async def _upload(self, paths: list[str], builder: BuildHost | None) -> set[str]:
+        """Upload `paths` in up to CACHE_UPLOAD_JOBS parallel `nix copy` runs; returns the failed ones.
+
+        Paths built on a remote build host are uploaded from there.
+        """
+        batches = [paths[i::CACHE_UPLOAD_JOBS] for i in range(min(CACHE_UPLOAD_JOBS, len(paths)))]
+        if builder is None:
+            commands = [["nix", "copy", "--to", self.url, *batch] for batch in batches]
+        else:
+            commands = [
+                ssh_command(
+                    builder.ssh_host, f"nix copy --to {self.url} {' '.join(batch)}",
+                    "-o", "BatchMode=yes",
+                    port=builder.ssh_port,
+                )
+                for batch in batches
+            ]
+        results = await asyncio.gather(*(run_command(cmd) for cmd in commands))
+        return {path for batch, (rc, _) in zip(batches, results) if rc != 0 for path in batch}
+
+    async def _check(self, paths: list[str], builder: BuildHost | None) -> tuple[int, int, set[str]]:
+        """Check `paths` and upload the missing ones.
+
+        Returns (remembered, uploaded, failed uploads).
+        """
+        if self.known is None:
+            self.known = HISTORY.narinfo_hits()
+        hashes = {path: os.path.basename(path)[:32] for path in paths}
+        unknown = [path for path in paths if hashes[path] not in self.known]
+        found = await self._lookup([hashes[path] for path in unknown])
+        missing = [path for path in unknown if not found[hashes[path]]]
+        failed = await self._upload(missing, builder) if missing else set()
+        hits = [hashes[path] for path in unknown if path not in failed]
+        HISTORY.record_narinfo_hits(hits)
+        self.known.update(hits)
+        return len(paths) - len(unknown), len(missing) - len(failed), failed
+
+    async def ensure(
+        self, node: Node, out_path: str, log_prefix: str = "", builder: BuildHost | None = None
+    ) -> bool:
+        """Upload whatever of out_path's closure the cache lacks.
+
+        `builder` is the remote build host holding out_path, if it wasn't built here.
+        Returns False if the closure could not be read or an upload failed;
+        the deploy goes on regardless (the remote builds what it can't fetch).
+        """
+        if builder is None:
+            cmd, env = ["nix-store", "--query", "--requisites", out_path], None
+        else:
+            cmd = ["nix", "path-info", "--recursive", "--store", f"ssh-ng://{builder.ssh_host}", out_path]
+            env = get_nix_ssh_env(builder.ssh_port, builder.ssh_host)
+        rc, output = await run_command(cmd, timeout=120, env=env, merge_stderr=False)
+        closure = [path for path in output.split() if path.startswith("/nix/store/")] if rc == 0 else []
+        if not closure:
+            print(f"{YELLOW}[ ! ]{NC} {log_prefix}Could not read the closure, skipping cache check")
+            return False
+
+        new = [path for path in closure if path not in self.checks]
+        own = None
+        if new:
+            own = asyncio.create_task(self._check(new, builder))
+            self.checks.update((path, own) for path in new)
+        tasks = list({self.checks[path] for path in closure})
+        # Shielded: other nodes may be waiting on the same checks
+        results = dict(zip(tasks, await asyncio.gather(*(asyncio.shield(task) for task in tasks))))
+
+        failed = set(closure) & {path for _, _, task_failed in results.values() for path in task_failed}
+        if failed:
+            print(f"{YELLOW}[ ! ]{NC} {log_prefix}{len(failed)} path(s) could not be uploaded to {self.url}")
+            return False
+        remembered, uploaded, _ = results[own] if own is not None else (0, 0, set())
+        looked_up = len(new) - remembered
+        summary = (
+            f"{len(closure)} paths: {looked_up} looked up, {remembered} remembered,"
+            f" {len(closure) - len(new)} checked for another node"
+        )
+        if uploaded:
+            print(f"{BLUE}[ * ]{NC} {log_prefix}Cache: uploaded {uploaded} missing path(s) ({summary})")
+        else:
+            print(f"{GREEN}[ ✓ ]{NC} {log_prefix}Cache complete ({summary})")
+        return True
+
+    def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+CACHE_CHECK = CacheCheck(BINARY_CACHE_URL)
+
+
+async def ensure_cached(node: Node, log_prefix: str = "") -> None:
+    """Before a cache-fetch activation, upload whatever of the node's closure the cache lacks."""
+    if not CHECK_CACHE or EVALUATOR is None:
+        return
+    evaluated = await EVALUATOR.result(node.name)
+    if not evaluated.out_path:
+        return
+    with timed_phase(node.name, "cache-check") as phase:
+        builder = BUILD_POOL.built_on.get(node.name) if BUILD_POOL is not None else None
+        phase["success"] = await CACHE_CHECK.ensure(node, evaluated.out_path, log_prefix, builder)
+
+
+# Global flags
+VERBOSE = False
+DEPLOY_MODE = "cache-fetch"  # local-push (-L) | cache-fetch | remote-build (-R) | auto (--mode)
+RACE_HOSTS = False
+GC_MODE = "auto"  # auto | always | never (--gc)
+SHIP_SOURCE = False
+CHECK_CACHE = True  # --no-cache-check turns off the pre-activation cache completeness check
+FAN_OUT = False
+KEEP_GOING = False  # --keep-going: no failure fingerprinting, every node builds on its own
+LOOKAHEAD_DEPTH = 1  # --lookahead: nodes built ahead of the one deploying in sequential runs
+
+# (node, host) pairs deployed this run, garbage collected after the wave (--gc=auto)
+GC_PENDING: list[tuple[Node, str]] = []
+
+
+class SSHMultiplexer:
+    """Shares one ControlMaster SSH connection per (host, port) for the whole run.
+
+    Every SSH call site adds options() to its command line. The first session
+    to a host becomes the master and later sessions (connectivity checks,
+    activation, cleanup, pct commands, nix copies via NIX_SSHOPTS) reuse it
+    instead of doing a full handshake. close() tears all masters down; a
+    run that dies without closing them leaves masters that exit after
+    SSH_CONTROL_PERSIST seconds idle.
+
+    A mux session only gets a forwarded agent if its master was opened with
+    one, so sessions that need the agent (remote git pull, peer copies) share
+    a second master per host that forwards it; the rest never forward it.
+    """
+
+    def __init__(self) -> None:
+        self.control_dir: str | None = None
+        self.hosts: set[tuple[str, int, bool]] = set()  # (host, port, forward_agent)
+
+    def control_path(self, forward_agent: bool) -> str:
+        # %C hashes local host, remote host, port and user
+        return f"{self.control_dir}/{'agent-' if forward_agent else ''}%C"
+
+    def options(self, target_host: str, port: int = 22, forward_agent: bool = False) -> list[str]:
+        """Return ssh options routing a session to target_host through its master."""
+        if self.control_dir is None:
+            # Short path under /tmp: unix socket paths are limited to ~104 bytes on macOS
+            self.control_dir = tempfile.mkdtemp(prefix="rebuild-ssh-", dir="/tmp")
+        self.hosts.add((target_host, port, forward_agent))
+        options = [
+            "-o", "ControlMaster=auto",
+            "-o", f"ControlPath={self.control_path(forward_agent)}",
+            "-o", f"ControlPersist={SSH_CONTROL_PERSIST}",
+        ]
+        if forward_agent:
+            options += ["-o", "ForwardAgent=yes"]
+        return options
+
+    async def close(self) -> None:
+        """Ask every master to exit and remove the control socket directory."""
+        if self.control_dir is None:
+            return
+
+        async def close_master(target_host: str, port: int, forward_agent: bool) -> None:
+            cmd = ["ssh", "-o", f"ControlPath={self.control_path(forward_agent)}"]
+            if port != 22:
+                cmd.extend(["-p", str(port)])
+            cmd.extend(["-O", "exit", target_host])
+            await run_command(cmd, timeout=5)
+
+        # No sockets: nothing connected (a dry run only prints commands)
+        if os.listdir(self.control_dir):
+            await asyncio.gather(*(close_master(*master) for master in self.hosts))
+        shutil.rmtree(self.control_dir, ignore_errors=True)
+        self.control_dir = None
+        self.hosts.clear()
+
+
+SSH_MUX = SSHMultiplexer()
+
+
+def ssh_command(
+    target_host: str, remote_cmd: str, *ssh_args: str, port: int = 22, forward_agent: bool = False
+) -> list[str]:
+    """Build an ssh command line that runs remote_cmd over the shared connection.
+
+    Args:
+        target_host: SSH target (user@host or just host)
+        remote_cmd: Command to run on the remote
+        ssh_args: Extra ssh options (e.g. "-o", "BatchMode=yes")
+        port: SSH port (only passed explicitly when not 22)
+        forward_agent: Forward the local SSH agent (like -A; uses the
+            host's agent-forwarding master, see SSHMultiplexer)
+    """
+    cmd = ["ssh", *SSH_MUX.options(target_host, port, forward_agent), *ssh_args]
+    if port != 22:
+        cmd.extend(["-p", str(port)])
+    cmd.extend([target_host, remote_cmd])
+    return cmd
+
+
+def get_nix_ssh_env(ssh_port: int, target_host: str) -> dict[str, str]:
+    """Get environment with NIX_SSHOPTS for custom SSH port and host key checking.
+
+    The options route nix's own ssh sessions through the shared connection.
+    """
+    env = os.environ.copy()
+    ssh_opts = [*SSH_MUX.options(target_host, ssh_port), "-o", "StrictHostKeyChecking=accept-new"]
+    if ssh_port != 22:
+        ssh_opts.extend(["-p", str(ssh_port)])
+    env["NIX_SSHOPTS"] = " ".join(ssh_opts)
+    return env
+
+
+
+
+def is_connection_error(output: str) -> bool:
+    """
+    Check if the error output indicates a connection failure vs deployment failure.
+
+    Connection failures should trigger fallback to the next host.
+    Deployment failures (build errors, etc.) should not.
     """
     connection_error_patterns = [
         "Connection refused",
@@ -494,7 +2243,126 @@ def is_connection_error(output: str) -> bool:
     return any(pattern.lower() in output_lower for pattern in connection_error_patterns)
 
 
-async def cleanup_remote(target_host: str) -> bool:
+def is_auth_error(output: str) -> bool:
+    """Whether the host refused our key.
+
+    Like a connection error it falls through to the next host, but retrying
+    the same host only fails the same way.
+    """
+    return "permission denied (publickey" in output.lower()
+
+
+def is_transient_error(output: str) -> bool:
+    """Whether a failure is worth retrying against the same host (see RetryPolicy)."""
+    return is_connection_error(output) and not is_auth_error(output)
+
+
+class RetryPolicy:
+    """Retries transient SSH failures and gives up on hosts that stay down.
+
+    run() retries an attempt against one (node, host) while it fails with a
+    transient connection error, sleeping base * 2^n seconds (capped, with
+    jitter so parallel nodes don't reconnect in lockstep) between tries.
+    Other failures, including a refused key, are returned at once.
+
+    Every connection failure also counts against the host for the whole
+    run, whichever node or phase hit it. Once a host has failed `threshold`
+    times in a row its circuit opens: probes fail fast and later phases skip
+    it instead of waiting out another ConnectTimeout.
+    """
+
+    def __init__(self, retries: int, base_delay: float, max_delay: float, threshold: int) -> None:
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.threshold = threshold
+        self.failures: dict[str, int] = defaultdict(int)  # host -> connection failures in a row
+        self.opened: set[str] = set()  # hosts given up on for the rest of the run
+        self.retried: dict[str, list[tuple[str, str]]] = defaultdict(list)  # node -> [(host, what)]
+
+    def is_open(self, target_host: str) -> bool:
+        return target_host in self.opened
+
+    def open_error(self, target_host: str) -> str:
+        """Connection-error style output for a skipped host (falls through to the next one)."""
+        return f"ssh: connect to host {target_host}: skipped, {self.threshold} connection failures in a row"
+
+    def record(self, target_host: str, ok: bool, connection_error: bool) -> None:
+        """Count one SSH outcome against the host, opening its circuit when it keeps failing."""
+        if ok:
+            self.failures.pop(target_host, None)
+            return
+        if not connection_error:
+            return
+        self.failures[target_host] += 1
+        if self.failures[target_host] >= self.threshold and target_host not in self.opened:
+            self.opened.add(target_host)
+            print(
+                f"{RED}[ ✗ ]{NC} {target_host} - {self.failures[target_host]} connection failures in a row, "
+                "not trying it again this run"
+            )
+
+    def delay(self, attempt: int) -> float:
+        """Backoff before retry number attempt (0-based): half fixed, half random."""
+        ceiling = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+    async def run(
+        self, node: Node, target_host: str, what: str, attempt, connection_error=None,
+        retries: int | None = None, log_prefix: str = "",
+    ):
+        """Run attempt() against target_host, retrying it on connection errors.
+
+        Args:
+            node: Node the attempt is for (retries are reported per node)
+            target_host: Host the attempt talks to
+            what: Phase name for messages and the summary (e.g. "probe")
+            attempt: Coroutine function returning (success, result)
+            connection_error: Whether a failed result was a transient connection
+                error (default: is_transient_error on the result)
+            retries: Override the number of retries (e.g. 0 when another
+                host can be tried instead)
+            log_prefix: Prefix for log messages
+
+        Returns:
+            The last (success, result) from attempt()
+        """
+        retries = self.retries if retries is None else retries
+        connection_error = connection_error or is_transient_error
+        n = 0
+        while True:
+            ok, result = await attempt()
+            transient = not ok and connection_error(result)
+            self.record(target_host, ok, transient)
+            if ok or not transient or n >= retries or self.is_open(target_host):
+                return ok, result
+            delay = self.delay(n)
+            n += 1
+            self.retried[node.name].append((target_host, what))
+            print(
+                f"{YELLOW}[ ! ]{NC} {log_prefix}{what} on {target_host}: connection error, "
+                f"retry {n}/{retries} in {delay:.1f}s"
+            )
+            await asyncio.sleep(delay)
+
+    def print_report(self) -> None:
+        """Summarise retries per node and the hosts given up on."""
+        if self.retried:
+            print(f"{YELLOW}[ ! ]{NC} Retried after connection errors:")
+            for name, retried in sorted(self.retried.items()):
+                counts = defaultdict(int)
+                for target_host, what in retried:
+                    counts[(target_host, what)] += 1
+                details = ", ".join(f"{what} on {host} x{count}" for (host, what), count in counts.items())
+                print(f"    {name}: {len(retried)} ({details})")
+        if self.opened:
+            print(f"{RED}[ ✗ ]{NC} Gave up on unreachable host(s): {', '.join(sorted(self.opened))}")
+
+
+RETRIES = RetryPolicy(SSH_RETRIES, SSH_RETRY_BASE_DELAY, SSH_RETRY_MAX_DELAY, CIRCUIT_BREAKER_THRESHOLD)
+
+
+async def cleanup_remote(target_host: str, port: int = 22) -> bool:
     """Run garbage collection on remote host after deployment.
 
     Removes old generations and cleans up the nix store to free disk space.
@@ -502,32 +2370,95 @@ async def cleanup_remote(target_host: str) -> bool:
 
     Args:
         target_host: SSH target (user@host or just host)
+        port: SSH port
 
     Returns:
         True if cleanup succeeded, False otherwise (non-fatal)
     """
     print(f"{BLUE}[ * ]{NC} Cleaning up old generations on {target_host}...")
-    try:
-        proc = await asyncio.create_subprocess_exec(
-            "ssh", "-o", "BatchMode=yes", "-o", "ConnectTimeout=30",
-            target_host, "sudo nix-collect-garbage -d",
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.STDOUT,
-        )
-        stdout, _ = await proc.communicate()
-        if proc.returncode == 0:
-            print(f"{GREEN}[ ✓ ]{NC} Cleanup completed on {target_host}")
-            return True
-        else:
-            output = stdout.decode()
-            print(f"{YELLOW}[ ! ]{NC} Cleanup failed on {target_host} (non-fatal)")
-            if output.strip():
-                for line in output.strip().split("\n")[-3:]:
-                    print(f"    {line}")
-            return False
-    except Exception as e:
-        print(f"{YELLOW}[ ! ]{NC} Cleanup failed on {target_host}: {e} (non-fatal)")
+    rc, output = await run_command(ssh_command(
+        target_host, "sudo nix-collect-garbage -d",
+        "-o", "BatchMode=yes", "-o", "ConnectTimeout=30",
+        port=port,
+    ))
+    if rc == 0:
+        print(f"{GREEN}[ ✓ ]{NC} Cleanup completed on {target_host}")
+        return True
+    else:
+        print(f"{YELLOW}[ ! ]{NC} Cleanup failed on {target_host} (non-fatal)")
+        if output.strip():
+            for line in output.strip().split("\n")[-3:]:
+                print(f"    {line}")
+        return False
+
+
+async def remote_disk_space(target_host: str, port: int = 22) -> tuple[int, int] | None:
+    """Size and free space of the remote's /nix/store filesystem in MiB, or None."""
+    rc, output = await run_command(ssh_command(
+        target_host, "df -Pk /nix/store | awk 'NR == 2 {print $2, $4}'",
+        "-o", "BatchMode=yes", "-o", "ConnectTimeout=30",
+        port=port,
+    ), merge_stderr=False)
+    fields = output.split()
+    if rc != 0 or len(fields) != 2 or not all(field.isdigit() for field in fields):
+        return None
+    return int(fields[0]) // 1024, int(fields[1]) // 1024
+
+
+async def gc_remote(node: Node, target_host: str) -> bool:
+    """Garbage collect a remote only as far as its free disk space requires (--gc=auto).
+
+    Below the free-space threshold, deletes all but the last GC_KEEP_GENERATIONS
+    system generations and runs `nix-store --gc --max-freed` for just the
+    bytes needed to get back to twice the threshold.
+
+    Returns:
+        True if no collection was needed or it succeeded (failures are non-fatal)
+    """
+    space = await remote_disk_space(target_host, node.ssh_port)
+    if space is None:
+        print(f"{YELLOW}[ ! ]{NC} {node.name}: could not read free space on {target_host}, skipping GC")
+        return False
+    total, free = space
+    threshold = max(GC_MIN_FREE, int(total * GC_MIN_FREE_FRACTION))
+    if free >= threshold:
+        print(f"{GREEN}[ ✓ ]{NC} {node.name}: {free}MiB free of {total}MiB, no GC needed")
+        return True
+
+    max_freed = min(total, 2 * threshold) - free
+    print(f"{BLUE}[ * ]{NC} {node.name}: {free}MiB free of {total}MiB, collecting up to {max_freed}MiB...")
+    rc, output = await run_command(ssh_command(
+        target_host,
+        f"sudo nix-env --profile /nix/var/nix/profiles/system --delete-generations +{GC_KEEP_GENERATIONS}"
+        f" && sudo nix-store --gc --max-freed {max_freed * 1024 * 1024}",
+        "-o", "BatchMode=yes", "-o", "ConnectTimeout=30",
+        port=node.ssh_port,
+    ))
+    if rc != 0:
+        print(f"{YELLOW}[ ! ]{NC} {node.name}: GC failed on {target_host} (non-fatal)")
+        for line in output.strip().split("\n")[-3:]:
+            print(f"    {line}")
         return False
+    space = await remote_disk_space(target_host, node.ssh_port)
+    after = f", {space[1]}MiB free now" if space else ""
+    print(f"{GREEN}[ ✓ ]{NC} {node.name}: GC completed{after}")
+    return True
+
+
+async def run_deferred_gc() -> None:
+    """Garbage collect every remote deployed this run, all at once (--gc=auto)."""
+    if not GC_PENDING:
+        return
+    print()
+    print(f"{BLUE}[ * ]{NC} Checking disk space on {len(GC_PENDING)} deployed node(s)...")
+
+    async def collect(node: Node, target_host: str) -> None:
+        with timed_phase(node.name, "gc") as phase:
+            phase["success"] = await gc_remote(node, target_host)
+
+    pending = list(GC_PENDING)
+    GC_PENDING.clear()
+    await asyncio.gather(*(collect(node, host) for node, host in pending))
 
 
 def get_pve_container_name(node_name: str) -> str:
@@ -541,21 +2472,225 @@ def get_pve_container_name(node_name: str) -> str:
 
 async def pve_ssh(pve_host: str, command: str) -> tuple[int, str]:
     """Run a command on a PVE host via SSH. Returns (returncode, stdout)."""
-    proc = await asyncio.create_subprocess_exec(
-        "ssh", "-o", "BatchMode=yes", "-o", "ConnectTimeout=5",
-        f"root@{pve_host}", command,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
+    rc, output = await run_command(
+        ssh_command(f"root@{pve_host}", command, "-o", "BatchMode=yes", "-o", "ConnectTimeout=5"),
+        merge_stderr=False,
     )
-    stdout, _ = await proc.communicate()
-    return proc.returncode, stdout.decode().strip()
+    return rc, output.strip()
+
+
+# Prints "@mem<TAB>MemAvailable MiB" and "@cpus<TAB>nproc" for a PVE host, then
+# "vmid<TAB>hostname<TAB>memory<TAB>cores" for every LXC on it
+# (only the current config, not [snapshot] sections)
+PVE_INVENTORY_COMMAND = (
+    "awk '$1 == \"MemAvailable:\" {print \"@mem\\t\" int($2 / 1024)}' /proc/meminfo;"
+    " printf '@cpus\\t%s\\n' \"$(nproc)\";"
+    " for conf in /etc/pve/lxc/*.conf; do"
+    " [ -e \"$conf\" ] || continue;"
+    " awk -v vmid=\"$(basename \"$conf\" .conf)\""
+    " '/^\\[/ {exit} $1 == \"hostname:\" {h = $2} $1 == \"memory:\" {m = $2} $1 == \"cores:\" {c = $2}"
+    " END {print vmid \"\\t\" h \"\\t\" m \"\\t\" c}' \"$conf\";"
+    " done"
+)
 
 
-async def boost_lxc_resources(node: Node, prefix: str = "") -> tuple[int, int, int] | None:
+@dataclass
+class PVEHost:
+    """A Proxmox host's LXCs and capacity, as read at the start of the run."""
+    containers: dict[str, tuple[int, int, int]]  # hostname -> (vmid, memory MiB, cores)
+    mem_available: int | None = None  # MiB
+    cpus: int | None = None
+
+
+class PVEInventory:
+    """Per-run view of the LXCs on each Proxmox host, with batched `pct set`.
+
+    The first lookup on a PVE host reads every container's VMID, hostname,
+    memory and cores, plus the host's free memory and CPU count, in one SSH
+    call; the result is reused for the rest of the run. `pct set` requests
+    for the same host arriving within PVE_BATCH_WINDOW of each other are
+    sent together in one SSH call.
+
+    Boosts are admitted against the host's capacity: concurrent boosts may
+    promise at most MemAvailable - PVE_MEMORY_RESERVE of extra RAM and nproc
+    extra cores. Boosts that do not fit wait until earlier ones are released
+    (a lone boost is always admitted).
+    """
+
+    def __init__(self) -> None:
+        self.inventories: dict[str, asyncio.Task] = {}
+        self.pending: dict[str, list[tuple[int, int, int, asyncio.Future]]] = defaultdict(list)
+        self.flushers: dict[str, asyncio.Task] = {}
+        self.capacity: dict[str, asyncio.Condition] = {}
+        self.committed: dict[str, list[int]] = defaultdict(lambda: [0, 0, 0])  # memory, cores, boosts
+        self.peaks: dict[str, dict[int, int]] = defaultdict(dict)  # host -> vmid -> peak MiB
+        self.samplers: dict[str, asyncio.Task] = {}
+
+    def prefetch(self, nodes: list["Node"]) -> None:
+        """Start fetching the inventory of every PVE host hosting one of `nodes`."""
+        for node in nodes:
+            pve_host = PVE_NODES.get(node.pve_node) if node.pve_node else None
+            if pve_host:
+                self._inventory(pve_host)
+
+    def _inventory(self, pve_host: str) -> asyncio.Task:
+        if pve_host not in self.inventories:
+            self.inventories[pve_host] = asyncio.create_task(self._fetch(pve_host))
+        return self.inventories[pve_host]
+
+    async def _fetch(self, pve_host: str) -> PVEHost | None:
+        rc, output = await pve_ssh(pve_host, PVE_INVENTORY_COMMAND)
+        if rc != 0:
+            return None
+        host = PVEHost(containers={})
+        for line in output.splitlines():
+            # Trailing empty fields may have been stripped along with the output
+            vmid, hostname, memory, cores = (line.split("\t") + ["", "", ""])[:4]
+            if vmid == "@mem" and hostname.isdigit():
+                host.mem_available = int(hostname)
+            elif vmid == "@cpus" and hostname.isdigit():
+                host.cpus = int(hostname)
+            elif vmid.isdigit() and hostname:
+                # Proxmox defaults: 512MiB, and no cores line means all host cores (treated as 1 like before)
+                host.containers[hostname] = (int(vmid), int(memory or 512), int(cores or 1))
+        return host
+
+    async def host(self, pve_host: str) -> PVEHost | None:
+        """The PVE host's inventory, or None if it could not be read.
+
+        A failed inventory fetch is not cached, so the next lookup retries.
+        """
+        task = self._inventory(pve_host)
+        host = await asyncio.shield(task)
+        if host is None and self.inventories.get(pve_host) is task:
+            del self.inventories[pve_host]
+        return host
+
+    async def container(self, pve_host: str, container_name: str) -> tuple[int, int, int] | None:
+        """Look up (vmid, memory_mib, cores) of a container by name, or None."""
+        host = await self.host(pve_host)
+        return host.containers.get(container_name) if host else None
+
+    def _fits(self, host: PVEHost, committed: list[int], memory: int, cores: int) -> bool:
+        used_memory, used_cores, boosts = committed
+        if boosts == 0:
+            return True
+        if host.mem_available is not None and used_memory + memory > host.mem_available - PVE_MEMORY_RESERVE:
+            return False
+        if host.cpus is not None and used_cores + cores > host.cpus:
+            return False
+        return True
+
+    async def admit(self, pve_host: str, memory: int, cores: int, on_hold=None) -> float:
+        """Wait until a boost of `memory` MiB / `cores` fits on the host.
+
+        Calls `on_hold(host, committed)` once if the boost has to wait.
+        Returns the seconds spent held back. Pair with release().
+        """
+        host = await self.host(pve_host) or PVEHost(containers={})
+        condition = self.capacity.setdefault(pve_host, asyncio.Condition())
+        committed = self.committed[pve_host]
+        start = time.monotonic()
+        async with condition:
+            if not self._fits(host, committed, memory, cores):
+                if on_hold:
+                    on_hold(host, committed)
+                await condition.wait_for(lambda: self._fits(host, committed, memory, cores))
+            committed[0] += memory
+            committed[1] += cores
+            committed[2] += 1
+        return time.monotonic() - start
+
+    async def release(self, pve_host: str, memory: int, cores: int) -> None:
+        """Return an admitted boost's capacity and wake waiting boosts."""
+        condition = self.capacity[pve_host]
+        committed = self.committed[pve_host]
+        async with condition:
+            committed[0] -= memory
+            committed[1] -= cores
+            committed[2] -= 1
+            condition.notify_all()
+
+    def start_sampling(self, pve_host: str, vmid: int) -> None:
+        """Track a container's peak memory use until stop_sampling()."""
+        self.peaks[pve_host][vmid] = 0
+        if pve_host not in self.samplers:
+            self.samplers[pve_host] = asyncio.create_task(self._sample(pve_host))
+
+    def stop_sampling(self, pve_host: str, vmid: int) -> int:
+        """Stop tracking a container; returns its peak in MiB (0 if never sampled)."""
+        return self.peaks[pve_host].pop(vmid, 0)
+
+    async def _sample(self, pve_host: str) -> None:
+        """Sample every tracked container on a host in one SSH call per interval.
+
+        Uses the cgroup's anonymous memory (what the build processes actually
+        hold), not memory.current, which also counts reclaimable page cache.
+        """
+        peaks = self.peaks[pve_host]
+        try:
+            while peaks:
+                vmids = " ".join(str(vmid) for vmid in peaks)
+                _, output = await pve_ssh(
+                    pve_host,
+                    f"for v in {vmids}; do awk -v v=$v '$1 == \"anon\" {{print v, int($2 / 1048576)}}'"
+                    " /sys/fs/cgroup/lxc/$v/memory.stat; done 2>/dev/null",
+                )
+                for line in output.splitlines():
+                    fields = line.split()
+                    if len(fields) == 2 and fields[0].isdigit() and fields[1].isdigit():
+                        vmid = int(fields[0])
+                        if vmid in peaks:
+                            peaks[vmid] = max(peaks[vmid], int(fields[1]))
+                await asyncio.sleep(BOOST_SAMPLE_INTERVAL)
+        finally:
+            del self.samplers[pve_host]
+
+    async def set_resources(self, pve_host: str, vmid: int, memory: int, cores: int) -> bool:
+        """Queue `pct set` for a container; returns whether it succeeded."""
+        future = asyncio.get_running_loop().create_future()
+        self.pending[pve_host].append((vmid, memory, cores, future))
+        if pve_host not in self.flushers:
+            self.flushers[pve_host] = asyncio.create_task(self._flush(pve_host))
+        return await future
+
+    async def _flush(self, pve_host: str) -> None:
+        await asyncio.sleep(PVE_BATCH_WINDOW)
+        del self.flushers[pve_host]
+        # Requests whose caller was cancelled in the meantime are dropped
+        batch = [request for request in self.pending.pop(pve_host, []) if not request[3].done()]
+        if not batch:
+            return
+
+        # One `pct set` per container, each followed by its exit status
+        script = "; ".join(
+            f"pct set {vmid} -memory {memory} -cores {cores}; echo \"rc {i} $?\""
+            for i, (vmid, memory, cores, _) in enumerate(batch)
+        )
+        _, output = await pve_ssh(pve_host, script)
+        statuses = {}
+        for line in output.splitlines():
+            fields = line.split()
+            if len(fields) == 3 and fields[0] == "rc":
+                statuses[int(fields[1])] = fields[2] == "0"
+        for i, (_, _, _, future) in enumerate(batch):
+            if not future.done():
+                future.set_result(statuses.get(i, False))
+
+
+PVE_INVENTORY = PVEInventory()
+
+
+async def boost_lxc_resources(
+    node: Node,
+    prefix: str = "",
+    memory: int = REBUILD_RAM_BOOST,
+    cores: int = REBUILD_CPU_BOOST,
+) -> tuple[int, int, int] | None:
     """Temporarily increase LXC RAM and CPU for rebuild.
 
-    SSHes to the PVE host, looks up VMID by container name,
-    and adds REBUILD_RAM_BOOST MiB and REBUILD_CPU_BOOST cores.
+    Looks up the VMID by container name in the PVE host's inventory
+    and adds `memory` MiB and `cores` cores (see plan_boost).
 
     Returns (vmid, original_memory_mib, original_cores) on success, None on failure.
     """
@@ -566,262 +2701,1051 @@ async def boost_lxc_resources(node: Node, prefix: str = "") -> tuple[int, int, i
     if not pve_host:
         return None
 
+    with timed_phase(node.name, "boost") as phase:
+        resource_info = await _boost_lxc_resources(node, pve_host, prefix, memory, cores)
+        phase["success"] = resource_info is not None
+    return resource_info
+
+
+async def _boost_lxc_resources(
+    node: Node, pve_host: str, prefix: str, memory: int, cores: int
+) -> tuple[int, int, int] | None:
+    """Boost an LXC on its PVE host (see boost_lxc_resources)."""
+
     log_prefix = f"[{node.name}] " if prefix else ""
     container_name = get_pve_container_name(node.name)
 
-    # Look up VMID by container name
-    rc, output = await pve_ssh(pve_host, f"pct list | awk '$NF == \"{container_name}\" {{print $1}}'")
-    if rc != 0 or not output:
+    container = await PVE_INVENTORY.container(pve_host, container_name)
+    if container is None:
         print(f"{YELLOW}[ ! ]{NC} {log_prefix}Could not find VMID for {container_name} on {node.pve_node}")
         return None
-    vmid = int(output)
-
-    # Get current memory and cores (separate queries to avoid output order issues)
-    rc, mem_out = await pve_ssh(pve_host, f"pct config {vmid} | awk '/^memory:/ {{print $2}}'")
-    if rc != 0 or not mem_out:
-        print(f"{YELLOW}[ ! ]{NC} {log_prefix}Could not read memory for VMID {vmid}")
-        return None
-    orig_mem = int(mem_out)
-
-    rc, cores_out = await pve_ssh(pve_host, f"pct config {vmid} | awk '/^cores:/ {{print $2}}'")
-    orig_cores = int(cores_out) if rc == 0 and cores_out else 1
+    vmid, orig_mem, orig_cores = container
 
-    new_mem = orig_mem + REBUILD_RAM_BOOST
-    new_cores = orig_cores + REBUILD_CPU_BOOST
+    new_mem = orig_mem + memory
+    new_cores = orig_cores + cores
     print(f"{BLUE}[ * ]{NC} {log_prefix}Boosting resources: {orig_mem}MiB/{orig_cores}c -> {new_mem}MiB/{new_cores}c (VMID {vmid} on {node.pve_node})")
 
-    rc, _ = await pve_ssh(pve_host, f"pct set {vmid} -memory {new_mem} -cores {new_cores}")
-    if rc != 0:
+    if not await PVE_INVENTORY.set_resources(pve_host, vmid, new_mem, new_cores):
         print(f"{YELLOW}[ ! ]{NC} {log_prefix}Failed to boost resources")
         return None
 
     return vmid, orig_mem, orig_cores
 
 
-async def restore_lxc_resources(node: Node, vmid: int, original_memory: int, original_cores: int, prefix: str = "") -> None:
-    """Restore LXC RAM and CPU to original values after rebuild."""
+async def restore_lxc_resources(node: Node, vmid: int, original_memory: int, original_cores: int, prefix: str = "") -> bool:
+    """Restore LXC RAM and CPU to original values after rebuild.
+
+    Returns True if the container was restored.
+    """
     if not node.pve_node:
-        return
+        return False
 
     pve_host = PVE_NODES.get(node.pve_node)
     if not pve_host:
-        return
+        return False
 
     log_prefix = f"[{node.name}] " if prefix else ""
     print(f"{BLUE}[ * ]{NC} {log_prefix}Restoring resources to {original_memory}MiB/{original_cores}c")
 
-    rc, _ = await pve_ssh(pve_host, f"pct set {vmid} -memory {original_memory} -cores {original_cores}")
-    if rc != 0:
+    with timed_phase(node.name, "restore") as phase:
+        phase["success"] = await PVE_INVENTORY.set_resources(pve_host, vmid, original_memory, original_cores)
+    if not phase["success"]:
         print(f"{YELLOW}[ ! ]{NC} {log_prefix}Failed to restore resources — manual fix: pct set {vmid} -memory {original_memory} -cores {original_cores}")
+    return phase["success"]
+
+
+async def restore_leftover_boosts() -> None:
+    """Restore LXC boosts journalled by an interrupted run (see DeployJournal).
+
+    Runs before any Proxmox inventory is read, so the new run sizes its
+    own boosts from the containers' real resources.
+    """
+    leftovers = JOURNAL.leftover_boosts()
+    if not leftovers:
+        return
+
+    async def restore(name: str, boost: dict) -> None:
+        pve_host = PVE_NODES.get(boost["pveNode"])
+        if not pve_host:
+            return
+        print(
+            f"{YELLOW}[ ! ]{NC} {name} - restoring resources left boosted by an interrupted run "
+            f"to {boost['memory']}MiB/{boost['cores']}c (VMID {boost['vmid']} on {boost['pveNode']})"
+        )
+        if await PVE_INVENTORY.set_resources(pve_host, boost["vmid"], boost["memory"], boost["cores"]):
+            JOURNAL.restore_boost(name, boost["pid"])
+        else:
+            print(
+                f"{YELLOW}[ ! ]{NC} {name} - failed to restore resources — manual fix: "
+                f"pct set {boost['vmid']} -memory {boost['memory']} -cores {boost['cores']}"
+            )
+
+    await asyncio.gather(*(restore(name, boost) for name, boost in leftovers.items()))
+
+
+@dataclass
+class BoostPlan:
+    """How much an LXC gets for a rebuild (see plan_boost)."""
+    cores: int  # extra cores
+    memory: int | None = None  # extra MiB on top of the container's own memory
+    memory_total: int | None = None  # or: MiB the container should have in total
+    source: str = "default"
+
+    def extra_memory(self, base_memory: int) -> int:
+        if self.memory_total is not None:
+            return max(0, self.memory_total - base_memory)
+        return self.memory or 0
+
+    def describe(self) -> str:
+        memory = f"{self.memory_total}MiB total" if self.memory_total is not None else f"+{self.memory}MiB"
+        return f"{memory}, +{self.cores}c ({self.source})"
+
+
+def plan_boost(node: Node) -> BoostPlan:
+    """Size a node's LXC boost.
+
+    A per-node "rebuildBoost" in nodes.json wins ({"memory": MiB, "cores": N}
+    to add, or false for no boost; true means the default sizing). Otherwise,
+    once a rebuild peak has been recorded, the container is sized to
+    peak * BOOST_MARGIN in total; before that it gets the fixed
+    REBUILD_RAM_BOOST / REBUILD_CPU_BOOST.
+    """
+    override = node.rebuild_boost
+    if override is False:
+        return BoostPlan(cores=0, memory=0, source="disabled in nodes.json")
+    if isinstance(override, dict):
+        return BoostPlan(
+            cores=override.get("cores", REBUILD_CPU_BOOST),
+            memory=override.get("memory", REBUILD_RAM_BOOST),
+            source="nodes.json",
+        )
+    peak = HISTORY.peak_memory(node.name)
+    if peak is None:
+        return BoostPlan(cores=REBUILD_CPU_BOOST, memory=REBUILD_RAM_BOOST, source="default, no recorded peak")
+    total = math.ceil(peak * BOOST_MARGIN / 256) * 256
+    return BoostPlan(cores=REBUILD_CPU_BOOST, memory_total=total, source=f"peak {peak}MiB x{BOOST_MARGIN}")
+
+
+@asynccontextmanager
+async def boosted_lxc(node: Node, prefix: str = ""):
+    """Boost a node's LXC for the duration of the block, then restore it.
+
+    The boost is sized by plan_boost() and first has to be admitted against
+    its Proxmox host's free memory and CPUs (see PVEInventory); time spent
+    held back is reported and counted as a scheduler wait. The container's
+    memory is sampled throughout and its peak recorded for future sizing.
+    No-op for nodes without a pveNode.
+    """
+    pve_host = PVE_NODES.get(node.pve_node) if node.pve_node else None
+    if not pve_host:
+        yield
+        return
+
+    log_prefix = f"[{node.name}] " if prefix else ""
+    container_name = get_pve_container_name(node.name)
+    container = await PVE_INVENTORY.container(pve_host, container_name)
+    if container is None:
+        print(f"{YELLOW}[ ! ]{NC} {log_prefix}Could not find VMID for {container_name} on {node.pve_node}")
+        yield
+        return
+    vmid, base_memory, _ = container
+    plan = plan_boost(node)
+    memory, cores = plan.extra_memory(base_memory), plan.cores
+
+    def on_hold(host: PVEHost, committed: list[int]) -> None:
+        free = f"{host.mem_available}MiB free, " if host.mem_available is not None else ""
+        print(
+            f"{BLUE}[ * ]{NC} {log_prefix}Holding boost until {node.pve_node} has capacity "
+            f"({free}{host.cpus or '?'} CPUs, {committed[2]} boost(s) running)..."
+        )
+
+    PVE_INVENTORY.start_sampling(pve_host, vmid)
+    try:
+        if memory == 0 and cores == 0:
+            print(f"{BLUE}[ * ]{NC} {log_prefix}No boost needed: {plan.describe()}")
+            yield
+            return
+
+        held = await PVE_INVENTORY.admit(pve_host, memory, cores, on_hold)
+        if held >= 0.1:
+            print(f"{BLUE}[ * ]{NC} {log_prefix}Boost admitted on {node.pve_node} after {format_duration(held)}")
+            if SCHEDULER is not None:
+                SCHEDULER.record_wait(node.name, f"capacity:{node.pve_node}", held)
+        try:
+            # Journalled before `pct set`: an interrupted run must not leave an unrecorded boost
+            JOURNAL.record_boost(node.name, node.pve_node, *container)
+            resource_info = await boost_lxc_resources(node, prefix, memory, cores)
+            if not resource_info:
+                JOURNAL.restore_boost(node.name)
+            try:
+                yield
+            finally:
+                if resource_info:
+                    vmid, orig_mem, orig_cores = resource_info
+                    if await restore_lxc_resources(node, vmid, orig_mem, orig_cores, prefix):
+                        JOURNAL.restore_boost(node.name)
+        finally:
+            await PVE_INVENTORY.release(pve_host, memory, cores)
+    finally:
+        peak = PVE_INVENTORY.stop_sampling(pve_host, vmid)
+        if peak:
+            HISTORY.record_peak(node.name, peak)
 
 
-async def check_ssh_connection(target_host: str) -> tuple[bool, str]:
+async def check_ssh_connection(target_host: str, port: int = 22) -> tuple[bool, str]:
     """
     Quick SSH connection check to verify host is reachable.
 
     Uses SSH config for connection settings (port, identity, etc.)
 
-    Returns (success, error_message).
-    """
+    Hosts given up on this run (see RetryPolicy) fail without connecting.
+
+    Returns (success, error_message).
+    """
+    if RETRIES.is_open(target_host):
+        return False, RETRIES.open_error(target_host)
+    rc, output = await run_command(ssh_command(
+        target_host, "true",
+        "-o", "BatchMode=yes", "-o", "ConnectTimeout=10",
+        "-o", "StrictHostKeyChecking=accept-new",
+        port=port,
+    ))
+    return rc == 0, output
+
+
+async def race_target_hosts(node: Node, stagger: float = HOST_RACE_STAGGER) -> tuple[str | None, str]:
+    """
+    Probe all of a node's target hosts at once and return the first to answer.
+
+    Happy-eyeballs style: each host starts `stagger` seconds after the
+    previous one (or immediately once the previous probe has failed), so
+    earlier entries win ties but a dead primary address no longer costs a
+    full ConnectTimeout. Losing probes are cancelled (their ssh is killed).
+    The winner is recorded in the reachability cache.
+
+    Returns (winning_host, error_output). winning_host is None if every
+    host failed; error_output is then the last failure's output.
+    """
+    hosts = node.target_hosts
+    started = [asyncio.Event() for _ in hosts]
+    failed = [asyncio.Event() for _ in hosts]
+
+    async def probe(i: int, host: str) -> tuple[str, bool, str, float]:
+        if i > 0:
+            await started[i - 1].wait()
+            try:
+                await asyncio.wait_for(failed[i - 1].wait(), stagger)
+            except asyncio.TimeoutError:
+                pass
+        started[i].set()
+        start = time.monotonic()
+        ok, output = await check_ssh_connection(host, node.ssh_port)
+        RETRIES.record(host, ok, is_transient_error(output))
+        if not ok:
+            failed[i].set()
+        return host, ok, output, time.monotonic() - start
+
+    tasks = [asyncio.create_task(probe(i, host)) for i, host in enumerate(hosts)]
+    error_output = ""
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            host, ok, output, rtt = await next_done
+            if ok:
+                REACHABILITY.record_host(node.name, host, rtt)
+                return host, ""
+            error_output = output
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return None, error_output
+
+
+async def try_remote_hosts(
+    node: Node, prefix: str = "", verified_host: str | None = None
+) -> tuple[str, bool, str]:
+    """
+    Try deploying to each target host in order until one succeeds.
+
+    Only falls back to the next host on connection errors.
+    Deployment failures (build errors, etc.) are returned immediately.
+    For LXC containers with pve_node set, temporarily boosts RAM during rebuild.
+
+    Args:
+        node: The node to deploy to
+        prefix: Optional prefix for log messages
+        verified_host: Host already known to be reachable (skips its probe)
+
+    Returns:
+        Tuple of (node_name, success, output)
+    """
+    log_prefix = f"[{node.name}] " if prefix else ""
+    output = ""
+    target_hosts = node.target_hosts
+
+    for i, target_host in enumerate(target_hosts):
+        host_info = (
+            f" (host {i + 1}/{len(target_hosts)}: {target_host})"
+            if len(target_hosts) > 1
+            else ""
+        )
+
+        # First, check if we can connect to this host (skipped if it just won the race)
+        if target_host == verified_host:
+            conn_ok, conn_output = True, ""
+        else:
+            print(
+                f"{BLUE}[ * ]{NC} {log_prefix}Checking connectivity to {target_host}..."
+            )
+            with timed_phase(node.name, "probe") as phase:
+                probe_start = time.monotonic()
+                # Another host to fall back on beats waiting to retry this one
+                conn_ok, conn_output = await RETRIES.run(
+                    node, target_host, "probe",
+                    lambda: check_ssh_connection(target_host, node.ssh_port),
+                    retries=0 if i < len(target_hosts) - 1 else None, log_prefix=log_prefix,
+                )
+                phase["success"] = conn_ok
+            if conn_ok:
+                REACHABILITY.record_host(node.name, target_host, time.monotonic() - probe_start)
+
+        if not conn_ok:
+            # Connection failed - try next host if available
+            if i < len(target_hosts) - 1:
+                print(
+                    f"{YELLOW}[ ! ]{NC} {log_prefix}Cannot connect to {target_host}, trying next host..."
+                )
+                continue
+            else:
+                print(f"{RED}[ ✗ ]{NC} {log_prefix}{node.name} - all hosts unreachable")
+                return node.name, False, conn_output
+
+        # Connection succeeded - proceed with deployment using the working host
+        print(
+            f"{BLUE}[ * ]{NC} {log_prefix}Deploying to {BOLD}{node.name}{NC}{host_info}..."
+        )
+
+        # cache-fetch (default): pre-build locally (populates cache), then remote fetches from cache
+        # local-push (-L): build locally and push closure via SSH
+        # remote-build (-R): remote builds and fetches from cache (no local build)
+        mode = deploy_mode(node)
+        if mode == "cache-fetch":
+            # Pre-build locally, then SSH in to activate from cache
+            with timed_phase(node.name, "prebuild") as phase:
+                phase["success"] = await prebuild_locally(node, prefix)
+            if not phase["success"]:
+                return node.name, False, "Local pre-build failed"
+            mode = await rechoose_mode(node, target_host, log_prefix)
+            if mode == "cache-fetch":
+                await ensure_cached(node, log_prefix)
+
+        if mode == "local-push":
+            # Wait for a build started ahead (--lookahead) rather than racing it
+            if LOOKAHEAD is not None and (ahead := LOOKAHEAD.take(node)) is not None and not await ahead:
+                return node.name, False, "Local build failed"
+            cmd = build_local_push_command(node, target_host)
+        else:
+            if SHIP_SOURCE:
+                # Copy the run's flake source snapshot over, then rebuild from it
+                async def ship() -> tuple[bool, tuple[str | None, str]]:
+                    shipped = await FLAKE_SOURCE.ship(node, target_host)
+                    return shipped[0] is not None, shipped
+
+                with timed_phase(node.name, "ship-source") as phase:
+                    _, (source, output) = await RETRIES.run(
+                        node, target_host, "ship-source", ship,
+                        lambda shipped: is_transient_error(shipped[1]), log_prefix=log_prefix,
+                    )
+                    phase["success"] = source is not None
+                if source is None:
+                    if is_connection_error(output) and i < len(target_hosts) - 1:
+                        print(f"{YELLOW}[ ! ]{NC} {log_prefix}Connection error to {target_host}, trying next host...")
+                        continue
+                    print(f"{RED}[ ✗ ]{NC} {log_prefix}{node.name} - shipping flake source failed")
+                    for line in output.strip().split("\n")[-5:]:
+                        print(f"    {line}")
+                    return node.name, False, output
+                cmd = build_remote_ssh_command(node, target_host, source)
+            else:
+                # Update the remote's config checkout, then rebuild from it
+                with timed_phase(node.name, "git-pull") as phase:
+                    success, tail = await RETRIES.run(
+                        node, target_host, "git-pull",
+                        lambda: run_deploy_command(build_remote_pull_command(node, target_host), prefix=log_prefix),
+                        lambda tail: tail.connection_error and not is_auth_error(tail.text), log_prefix=log_prefix,
+                    )
+                    phase["success"] = success
+                output = tail.text
+                if not success:
+                    if tail.connection_error and i < len(target_hosts) - 1:
+                        print(f"{YELLOW}[ ! ]{NC} {log_prefix}Connection error to {target_host}, trying next host...")
+                        continue
+                    print(f"{RED}[ ✗ ]{NC} {log_prefix}{node.name} - git pull on remote failed")
+                    for line in tail.last(5):
+                        print(f"    {line}")
+                    return node.name, False, output
+                cmd = build_remote_ssh_command(node, target_host)
+
+        env = get_nix_ssh_env(node.ssh_port, target_host)
+
+        # -L and -R build as part of the deploy: don't start one that needs an already failed derivation
+        if mode != "cache-fetch" and (blocker := await FAILURES.blocker(node)):
+            FAILURES.skip(node, blocker, log_prefix)
+            return node.name, False, f"needs failed derivation {blocker}"
+
+        # local-push pushes the closure; otherwise the remote fetches from cache and activates
+        deploy_phase = "transfer" if mode == "local-push" else "activate"
+        pve_queue = f"pve:{node.pve_node}" if node.pve_node else None
+        # Boost LXC resources before deployment, restore after (success or failure)
+        async with phase_slot(node, deploy_phase), phase_slot(node, pve_queue), boosted_lxc(node, prefix):
+            with timed_phase(node.name, deploy_phase) as activation:
+                success, tail = await RETRIES.run(
+                    node, target_host, deploy_phase,
+                    lambda: run_deploy_command(cmd, env, prefix=log_prefix),
+                    lambda tail: tail.connection_error and not is_auth_error(tail.text), log_prefix=log_prefix,
+                )
+                activation["success"] = success
+        output = tail.text
+
+        if success:
+            print(f"{GREEN}[ ✓ ]{NC} {log_prefix}{node.name} - deployment successful")
+            if GC_MODE == "always":
+                # Old behaviour: collect everything right away, on the node's critical path
+                with timed_phase(node.name, "cleanup") as phase:
+                    phase["success"] = await cleanup_remote(target_host, node.ssh_port)
+            elif GC_MODE == "auto":
+                GC_PENDING.append((node, target_host))
+            return node.name, True, output
+
+        # Deployment failed - check if it's a connection error or actual deployment failure
+        if tail.connection_error and i < len(target_hosts) - 1:
+            # Show the actual error before trying next host
+            print(
+                f"{YELLOW}[ ! ]{NC} {log_prefix}Connection error to {target_host}:"
+            )
+            for line in tail.last(5):
+                print(f"    {line}")
+            print(f"{YELLOW}[ * ]{NC} Trying next host...")
+            continue
+
+        # Deployment failure (not connection-related) - return error immediately
+        FAILURES.report(node, output, log_prefix, f"{node.name} - deployment failed", count=10)
+        return node.name, False, output
+
+    return node.name, False, output
+
+
+async def deploy_node(node: Node, prefix: str = "") -> tuple[str, bool, str]:
+    """
+    Deploy to a single node asynchronously.
+
+    The whole deployment is recorded in the history as the node's "total"
+    phase, minus the time it spent queued behind other nodes, so ordering
+    and predictions learn from the node's own work rather than from past
+    contention.
+
+    Args:
+        node: The node to deploy to
+        prefix: Optional prefix for log messages (used in parallel mode)
+
+    Returns:
+        Tuple of (node_name, success, output)
+    """
+    with timed_phase(node.name, "total") as phase:
+        try:
+            result = await _deploy_node(node, prefix)
+            phase["success"] = result[1]
+        finally:
+            phase["waited"] = SCHEDULER.waited(node.name) if SCHEDULER else 0.0
+    JOURNAL.finish_node(node.name, "done" if result[1] else "failed")
+    return result
+
+
+async def _deploy_node(node: Node, prefix: str = "") -> tuple[str, bool, str]:
+    """Deploy to a single node (see deploy_node)."""
+    log_prefix = f"[{node.name}] " if prefix else ""
+
+    # Determine if this is a local or remote deployment
+    if await is_local_deploy(node):
+        print(
+            f"{BLUE}[ * ]{NC} {log_prefix}Deploying to {BOLD}{node.name}{NC} (local)..."
+        )
+        cmd = build_local_command(node)
+
+        async with phase_slot(node, "build"):
+            with timed_phase(node.name, "local-switch") as phase:
+                success, tail = await run_deploy_command(cmd, prefix=log_prefix)
+                phase["success"] = success
+
+        if success:
+            print(f"{GREEN}[ ✓ ]{NC} {log_prefix}{node.name} - deployment successful")
+        else:
+            print(f"{RED}[ ✗ ]{NC} {log_prefix}{node.name} - deployment failed")
+            if not VERBOSE:
+                lines = tail.last(5)
+                if lines:
+                    print(f"{YELLOW}[ * ]{NC} Last output:")
+                    for line in lines:
+                        print(f"    {line}")
+
+        return node.name, success, tail.text
+    else:
+        # Remote deployment
+        verified_host = None
+        revalidation = None
+        if len(node.target_hosts) > 1 and REACHABILITY.get_host(node.name) == node.target_hosts[0]:
+            # Cached winner is tried first (get_nodes ordered it); refresh the
+            # cache off the critical path so the next run sees current RTTs
+            revalidation = asyncio.create_task(race_target_hosts(node, stagger=0))
+        elif RACE_HOSTS and len(node.target_hosts) > 1:
+            print(
+                f"{BLUE}[ * ]{NC} {log_prefix}Racing connectivity to {', '.join(node.target_hosts)}..."
+            )
+            with timed_phase(node.name, "probe") as phase:
+                verified_host, race_output = await race_target_hosts(node)
+                phase["success"] = verified_host is not None
+            if verified_host is None:
+                print(f"{RED}[ ✗ ]{NC} {log_prefix}{node.name} - all hosts unreachable")
+                return node.name, False, race_output
+            print(f"{BLUE}[ * ]{NC} {log_prefix}Selected {verified_host}")
+            # Winner first; the rest stay in order as fallbacks for deploy-time connection errors
+            node = replace(
+                node,
+                target_hosts=[verified_host] + [h for h in node.target_hosts if h != verified_host],
+            )
+
+        try:
+            # When pushing a local build, skip remote preparation (no need to copy age/ssh keys)
+            if deploy_mode(node) != "local-push":
+                # Ensure remote is prepared first
+                with timed_phase(node.name, "prepare") as phase:
+                    phase["success"] = await ensure_remote_prepared(node, log_prefix)
+                if not phase["success"]:
+                    print(f"{RED}[ ✗ ]{NC} {log_prefix}{node.name} - remote not prepared and setup failed")
+                    return node.name, False, "Remote not prepared for deployment"
+
+            # Remote deployment - try each host in order
+            return await try_remote_hosts(node, prefix, verified_host)
+        finally:
+            if revalidation:
+                await asyncio.gather(revalidation, return_exceptions=True)
+
+
+async def query_current_system(node: Node, current_host: str) -> str | None:
+    """Return the store path the node's /run/current-system points to.
+
+    One cheap query: a local readlink for the current host, otherwise a
+    single ssh round-trip to the first reachable target host.
+    """
+    if node.name == current_host:
+        path = os.path.realpath("/run/current-system")
+        return path if path.startswith("/nix/store/") else None
+
+    for target_host in node.target_hosts:
+        if RETRIES.is_open(target_host):
+            continue
+        rc, output = await run_command(
+            ssh_command(
+                target_host, "readlink -f /run/current-system",
+                "-o", "BatchMode=yes", "-o", "ConnectTimeout=10",
+                port=node.ssh_port,
+            ),
+            merge_stderr=False,
+        )
+        # ssh exits 255 on connection errors (stderr is not captured here)
+        RETRIES.record(target_host, rc == 0, rc == 255)
+        if rc == 0 and output.strip().startswith("/nix/store/"):
+            return output.strip()
+    return None
+
+
+async def find_unchanged_nodes(nodes: list[Node], current_host: str) -> dict[str, str]:
+    """
+    Pre-flight: find nodes already running the evaluated system closure.
+
+    Compares each node's evaluated toplevel out-path (from EVALUATOR) with
+    the node's current system. Nodes where evaluation or the remote query
+    fails are treated as changed (the deployment will surface the real error).
+
+    Returns:
+        Dict of unchanged node name to its (current) system store path
+    """
+    print(f"{BLUE}[ * ]{NC} Checking which nodes are already up to date...")
+
+    async def check(node: Node) -> tuple[str, str | None, str | None]:
+        evaluated, current = await asyncio.gather(
+            EVALUATOR.result(node.name),
+            query_current_system(node, current_host),
+        )
+        return node.name, evaluated.out_path, current
+
+    results = await asyncio.gather(*(check(node) for node in nodes))
+    return {
+        name: wanted
+        for name, wanted, current in results
+        if wanted is not None and wanted == current
+    }
+
+
+@dataclass
+class ModeChoice:
+    """How one remote node gets its new system, and why (--mode=auto).
+
+    A choice made before the closure exists anywhere is provisional
+    (`final` False): the node pre-builds and the choice is made again
+    once the closure is in the local store.
+    """
+    mode: str  # local-push | cache-fetch | remote-build
+    reason: str
+    final: bool = True
+
+
+# Per-node choices made by choose_modes() for --mode=auto
+MODE_CHOICES: dict[str, ModeChoice] = {}
+
+_local_systems: set[str] | None = None
+_local_builders: bool | None = None
+
+
+def deploy_mode(node: Node) -> str:
+    """The node's mode: local-push (-L), cache-fetch (default) or remote-build (-R)."""
+    choice = MODE_CHOICES.get(node.name)
+    if choice is not None:
+        return choice.mode
+    return "cache-fetch" if DEPLOY_MODE == "auto" else DEPLOY_MODE
+
+
+async def can_build_locally(system: str | None) -> bool:
+    """Whether this machine (or its configured remote builders) can build for `system`."""
+    global _local_systems, _local_builders
+    if _local_systems is None:
+        machine = os.uname().machine.lower()
+        arch = {"arm64": "aarch64", "amd64": "x86_64"}.get(machine, machine)
+        _local_systems, _local_builders = {f"{arch}-{sys.platform}"}, False
+        rc, output = await run_command(["nix", "config", "show"], timeout=30, merge_stderr=False)
+        for line in output.splitlines() if rc == 0 else []:
+            key, _, value = line.partition(" = ")
+            if key == "extra-platforms":
+                _local_systems.update(value.split())
+            elif key == "builders" and value.strip():
+                builders = value.strip()
+                if builders.startswith("@"):
+                    try:
+                        with open(builders[1:]) as f:
+                            builders = "".join(line for line in f if not line.lstrip().startswith("#"))
+                    except OSError:
+                        builders = ""
+                _local_builders = bool(builders.strip())
+    return system is None or system in _local_systems or _local_builders
+
+
+async def query_closure(out_path: str, store: str | None = None) -> dict[str, dict] | None:
+    """Path-info of every path in `out_path`'s closure, from the local store or a binary cache.
+
+    Returns:
+        Dict of store path to its path-info (narSize, and url for a cache),
+        or None if the closure is not (completely) in that store.
+    """
+    cmd = ["nix", "path-info", "--recursive", "--json", out_path]
+    if store:
+        cmd += ["--store", store]
+    rc, output = await run_command(cmd, timeout=120, merge_stderr=False)
+    if rc != 0:
+        return None
+    try:
+        info = json.loads(output)
+    except json.JSONDecodeError:
+        return None
+    # Nix >= 2.19 keys the output by path, older releases return a list
+    entries = info.items() if isinstance(info, dict) else ((e.get("path"), e) for e in info)
+    closure = {path: entry for path, entry in entries if path and entry}
+    return closure or None
+
+
+async def query_missing_paths(node: Node, target_host: str, paths: list[str]) -> list[str] | None:
+    """The subset of `paths` the remote's store does not have (None if the query failed)."""
+    rc, output = await run_command(
+        ssh_command(
+            target_host, "xargs -r nix-store --check-validity --print-invalid",
+            "-o", "BatchMode=yes", "-o", "ConnectTimeout=10",
+            port=node.ssh_port,
+        ),
+        timeout=60,
+        merge_stderr=False,
+        input="\n".join(paths).encode(),
+    )
+    if rc != 0:
+        return None
+    return [line for line in output.split() if line.startswith("/nix/store/")]
+
+
+async def measure_push(node: Node, target_host: str) -> float | None:
+    """Workstation -> remote throughput in bytes/s over SSH (cached like reachability)."""
+    bps = REACHABILITY.get_throughput(target_host, "push")
+    if bps is None:
+        start = time.monotonic()
+        rc, _ = await run_command(
+            ssh_command(target_host, "cat > /dev/null", "-o", "BatchMode=yes", port=node.ssh_port),
+            timeout=60,
+            input=os.urandom(MODE_PROBE_BYTES),
+        )
+        if rc != 0:
+            return None
+        bps = MODE_PROBE_BYTES / max(time.monotonic() - start, 0.001)
+        REACHABILITY.record_throughput(target_host, "push", bps)
+    return bps
+
+
+async def measure_fetch(node: Node, target_host: str, nar_url: str) -> float | None:
+    """Cache -> remote throughput in bytes/s, timing the remote's download of one NAR."""
+    bps = REACHABILITY.get_throughput(target_host, "fetch")
+    if bps is None:
+        rc, output = await run_command(
+            ssh_command(
+                target_host,
+                f"curl -sf -o /dev/null --max-time 20 -r 0-{MODE_PROBE_BYTES - 1}"
+                f" -w '%{{speed_download}}' {BINARY_CACHE_URL}/{nar_url}",
+                "-o", "BatchMode=yes",
+                port=node.ssh_port,
+            ),
+            timeout=60,
+            merge_stderr=False,
+        )
+        try:
+            bps = float(output.strip()) if rc == 0 else 0.0
+        except ValueError:
+            bps = 0.0
+        if bps <= 0:
+            return None  # no curl on the remote, or the cache is unreachable from it
+        REACHABILITY.record_throughput(target_host, "fetch", bps)
+    return bps
+
+
+async def choose_mode(node: Node, target_host: str) -> ModeChoice:
+    """Pick local-push, cache-fetch or remote-build for one remote node.
+
+    Compares the NAR size of the closure paths the remote is missing over
+    the measured push (workstation -> remote) and fetch (cache -> remote)
+    throughput. Nodes whose system can't be built here and isn't cached
+    build on the remote.
+    """
+    evaluated = await EVALUATOR.result(node.name)
+    if evaluated.error or not evaluated.out_path:
+        return ModeChoice("cache-fetch", "evaluation failed")
+    buildable = await can_build_locally(evaluated.system)
+
+    local, cached = await asyncio.gather(
+        query_closure(evaluated.out_path),
+        query_closure(evaluated.out_path, BINARY_CACHE_URL),
+    )
+    if local is None and cached is None:
+        if not buildable:
+            return ModeChoice("remote-build", f"{evaluated.system} can't be built here and isn't cached")
+        return ModeChoice("cache-fetch", "not built yet; decided after the local pre-build", final=False)
+
+    closure = local or cached
+    missing = await query_missing_paths(node, target_host, list(closure))
+    if missing is None:
+        return ModeChoice("cache-fetch", f"could not query {target_host}'s store")
+    size = sum(closure[path].get("narSize", 0) for path in missing)
+    summary = f"{len(missing)}/{len(closure)} paths missing, {format_size(size)} NAR"
+    if not missing:
+        return ModeChoice("cache-fetch", f"{summary}, nothing to transfer")
+    if local is None:
+        return ModeChoice("cache-fetch", f"{summary}, cached but not in the local store")
+
+    # Time a download of the largest cached path's NAR on the remote
+    nar_url = None
+    if cached:
+        largest = max(cached, key=lambda path: cached[path].get("narSize", 0))
+        nar_url = cached[largest].get("url")
+    push, fetch = await asyncio.gather(
+        measure_push(node, target_host),
+        measure_fetch(node, target_host, nar_url) if nar_url else asyncio.sleep(0),
+    )
+    rates = ", ".join(
+        f"{label} {format_size(bps)}/s" for label, bps in [("push", push), ("fetch", fetch)] if bps
+    )
+    summary = f"{summary}, {rates or 'link not measured'}"
+    if push and fetch:
+        push_time, fetch_time = size / push, size / fetch
+        if push_time * MODE_PUSH_ADVANTAGE < fetch_time:
+            return ModeChoice("local-push", f"{summary}: push ~{format_duration(push_time)}"
+                              f" vs fetch ~{format_duration(fetch_time)}")
+        return ModeChoice("cache-fetch", f"{summary}: fetch ~{format_duration(fetch_time)}"
+                          f" vs push ~{format_duration(push_time)}")
+    if push and push >= MODE_LAN_THROUGHPUT:
+        return ModeChoice("local-push", f"{summary}: LAN-speed link")
+    return ModeChoice("cache-fetch", summary)
+
+
+async def rechoose_mode(node: Node, target_host: str, log_prefix: str = "") -> str:
+    """Settle a provisional --mode=auto choice once the closure is built locally."""
+    choice = MODE_CHOICES.get(node.name)
+    if choice is None or choice.final:
+        return deploy_mode(node)
+    choice = MODE_CHOICES[node.name] = await choose_mode(node, target_host)
+    print(f"{BLUE}[ * ]{NC} {log_prefix}Mode: {choice.mode} ({choice.reason})")
+    return choice.mode
+
+
+async def choose_modes(nodes: list[Node], current_host: str) -> None:
+    """Fill MODE_CHOICES for every remote node (--mode=auto), all nodes at once."""
+    print(f"{BLUE}[ * ]{NC} Choosing a transfer mode per node...")
+
+    async def choose(node: Node) -> None:
+        target_host, _ = await race_target_hosts(node)
+        if target_host is None:
+            MODE_CHOICES[node.name] = ModeChoice("cache-fetch", "no target host reachable")
+        else:
+            MODE_CHOICES[node.name] = await choose_mode(node, target_host)
+
+    await asyncio.gather(*(choose(node) for node in nodes if node.name != current_host))
+
+
+def fanout_site(node: Node, target_host: str) -> str:
+    """--fan-out group of a node: its Proxmox host, else its target's subnet (/24, /64)."""
+    if node.pve_node:
+        return f"pve:{node.pve_node}"
+    address = target_host.rsplit("@", 1)[-1]
     try:
-        proc = await asyncio.create_subprocess_exec(
-            "ssh", "-o", "BatchMode=yes", "-o", "ConnectTimeout=10",
-            "-o", "StrictHostKeyChecking=accept-new",
-            target_host, "true",
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.STDOUT,
-        )
-        stdout, _ = await proc.communicate()
-        output = stdout.decode()
-        return proc.returncode == 0, output
-    except Exception as e:
-        return False, str(e)
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return address  # a hostname: its own site
+    return str(ipaddress.ip_network(f"{ip}/{24 if ip.version == 4 else 64}", strict=False))
 
 
-async def try_remote_hosts(node: Node, prefix: str = "") -> tuple[str, bool, str]:
-    """
-    Try deploying to each target host in order until one succeeds.
+def fanout_sites(members: list[tuple[Node, str]]) -> dict[str, list[tuple[Node, str]]]:
+    """Group (node, target host) pairs by site, keeping only sites with more than one node."""
+    sites: dict[str, list[tuple[Node, str]]] = defaultdict(list)
+    for node, target_host in members:
+        sites[fanout_site(node, target_host)].append((node, target_host))
+    return {site: group for site, group in sites.items() if len(group) > 1}
 
-    Only falls back to the next host on connection errors.
-    Deployment failures (build errors, etc.) are returned immediately.
-    For LXC containers with pve_node set, temporarily boosts RAM during rebuild.
 
-    Args:
-        node: The node to deploy to
-        prefix: Optional prefix for log messages
+def fanout_children(index: int, count: int) -> list[int]:
+    """Children of member `index` in a site's copy tree (heap layout, FANOUT_WIDTH wide)."""
+    first = index * FANOUT_WIDTH + 1
+    return list(range(first, min(first + FANOUT_WIDTH, count)))
 
-    Returns:
-        Tuple of (node_name, success, output)
-    """
-    log_prefix = f"[{node.name}] " if prefix else ""
-    output = ""
 
-    for i, target_host in enumerate(node.target_hosts):
-        host_info = (
-            f" (host {i + 1}/{len(node.target_hosts)}: {target_host})"
-            if len(node.target_hosts) > 1
-            else ""
-        )
+def fanout_subtree(index: int, count: int) -> list[int]:
+    """Member `index` and everything it seeds, directly or through its children."""
+    subtree = [index]
+    for child in fanout_children(index, count):
+        subtree += fanout_subtree(child, count)
+    return subtree
 
-        # First, check if we can connect to this host
-        print(
-            f"{BLUE}[ * ]{NC} {log_prefix}Checking connectivity to {target_host}..."
-        )
-        conn_ok, conn_output = await check_ssh_connection(target_host)
 
-        if not conn_ok:
-            # Connection failed - try next host if available
-            if i < len(node.target_hosts) - 1:
-                print(
-                    f"{YELLOW}[ ! ]{NC} {log_prefix}Cannot connect to {target_host}, trying next host..."
-                )
-                continue
-            else:
-                print(f"{RED}[ ✗ ]{NC} {log_prefix}{node.name} - all hosts unreachable")
-                return node.name, False, conn_output
+def describe_fanout_tree(group: list[tuple[Node, str]], index: int = 0) -> str:
+    """e.g. `beta -> (gamma, delta -> (epsilon))` for a site's copy tree."""
+    children = fanout_children(index, len(group))
+    name = group[index][0].name
+    if not children:
+        return name
+    return f"{name} -> ({', '.join(describe_fanout_tree(group, child) for child in children)})"
 
-        # Connection succeeded - proceed with deployment using the working host
-        print(
-            f"{BLUE}[ * ]{NC} {log_prefix}Deploying to {BOLD}{node.name}{NC}{host_info}..."
-        )
 
-        # Default mode: pre-build locally (populates cache), then remote fetches from cache
-        # -L mode: build locally and push closure via SSH
-        # -R mode: remote builds and fetches from cache (no local build)
-        if LOCAL_BUILD:
-            cmd = build_local_push_command(node, target_host)
-        elif REMOTE_BUILD:
-            cmd = build_remote_ssh_command(node, target_host)
+async def seed_site(site: str, group: list[tuple[Node, str, str]], sent: dict[str, int]) -> None:
+    """Copy a site's closures down its tree: this machine seeds the first node, peers the rest.
+
+    Each member receives the toplevels of its whole subtree, so it can pass
+    them on. NAR bytes actually missing on each receiver are added to
+    sent["workstation"] or sent["peers"]. A member whose copy fails leaves
+    its subtree to the normal per-node push.
+    """
+    closures = await asyncio.gather(*(query_closure(out_path) for _, _, out_path in group))
+
+    async def copy(parent: int | None, index: int) -> None:
+        node, target_host, _ = group[index]
+        subtree = fanout_subtree(index, len(group))
+        out_paths = [group[i][2] for i in subtree]
+        paths: dict[str, dict] = {}
+        for i in subtree:
+            paths.update(closures[i] or {})
+        missing = await query_missing_paths(node, target_host, list(paths)) if paths else None
+        size = sum(paths[path].get("narSize", 0) for path in missing or [])
+        log_prefix = f"[{node.name}] "
+
+        if parent is None:
+            source = "this machine"
+            cmd = ["nix-copy-closure", "--to", target_host, *out_paths]
+            env = get_nix_ssh_env(node.ssh_port, target_host)
         else:
-            # Default: pre-build locally, then SSH in to activate from cache
-            if not await prebuild_locally(node, prefix):
-                return node.name, False, "Local pre-build failed"
-            cmd = build_remote_ssh_command(node, target_host)
+            parent_node, parent_host, _ = group[parent]
+            source = parent_node.name
+            ssh_opts = "-o StrictHostKeyChecking=accept-new"
+            if node.ssh_port != 22:
+                ssh_opts += f" -p {node.ssh_port}"
+            cmd = ssh_command(
+                parent_host,
+                f"NIX_SSHOPTS='{ssh_opts}' nix-copy-closure --to {target_host} {' '.join(out_paths)}",
+                "-o", "StrictHostKeyChecking=accept-new",
+                port=parent_node.ssh_port, forward_agent=True,
+            )
+            env = None
+        print(f"{BLUE}[ * ]{NC} {log_prefix}Fan-out: {format_size(size)} from {source}")
+        with timed_phase(node.name, "fan-out") as phase:
+            success, tail = await run_deploy_command(cmd, env, prefix=log_prefix)
+            phase["success"] = success
+        if not success:
+            print(f"{YELLOW}[ ! ]{NC} {log_prefix}Fan-out copy from {source} failed, "
+                  f"{len(subtree)} node(s) fall back to a direct push")
+            for line in tail.last(3):
+                print(f"    {line}")
+            return
+        sent["workstation" if parent is None else "peers"] += size
+        await asyncio.gather(*(copy(index, child) for child in fanout_children(index, len(group))))
 
-        env = get_nix_ssh_env(node.ssh_port)
+    print(f"{BLUE}[ * ]{NC} Fan-out {site}: {describe_fanout_tree(group)}")
+    await copy(None, 0)
 
-        # Boost LXC resources before deployment, restore after (success or failure)
-        resource_info = await boost_lxc_resources(node, prefix)
-        try:
-            if VERBOSE:
-                # Stream output in real-time
-                proc = await asyncio.create_subprocess_exec(
-                    *cmd,
-                    stdout=None,  # Inherit stdout
-                    stderr=None,  # Inherit stderr
-                    env=env,
-                )
-                await proc.wait()
-                output = ""
-                success = proc.returncode == 0
-            else:
-                proc = await asyncio.create_subprocess_exec(
-                    *cmd,
-                    stdout=asyncio.subprocess.PIPE,
-                    stderr=asyncio.subprocess.STDOUT,
-                    env=env,
-                )
-                stdout, _ = await proc.communicate()
-                output = stdout.decode()
-                success = proc.returncode == 0
-        finally:
-            if resource_info:
-                vmid, orig_mem, orig_cores = resource_info
-                await restore_lxc_resources(node, vmid, orig_mem, orig_cores, prefix)
 
-        if success:
-            print(f"{GREEN}[ ✓ ]{NC} {log_prefix}{node.name} - deployment successful")
-            # Run garbage collection on remote to free disk space
-            await cleanup_remote(target_host)
-            return node.name, True, output
+async def fan_out(nodes: list[Node]) -> None:
+    """Pre-seed local-push nodes through per-site copy trees (--fan-out).
 
-        # Deployment failed - check if it's a connection error or actual deployment failure
-        if is_connection_error(output) and i < len(node.target_hosts) - 1:
-            # Show the actual error before trying next host
-            lines = output.strip().split("\n")
-            print(
-                f"{YELLOW}[ ! ]{NC} {log_prefix}Connection error to {target_host}:"
-            )
-            for line in lines[-5:]:
-                print(f"    {line}")
-            print(f"{YELLOW}[ * ]{NC} Trying next host...")
-            continue
+    Instead of this machine pushing the same base system to every node,
+    it pushes once per site (Proxmox host or subnet) and the nodes copy to
+    their siblings. The per-node push afterwards finds everything in place.
+    """
+    async def build(node: Node) -> bool:
+        with timed_phase(node.name, "prebuild") as phase:
+            phase["success"] = await prebuild_locally(node, "fan-out")
+        return phase["success"]
+
+    built = await asyncio.gather(*(build(node) for node in nodes))
+    evaluated = await asyncio.gather(*(EVALUATOR.result(node.name) for node in nodes))
+    hosts = await asyncio.gather(*(race_target_hosts(node) for node in nodes))
+    members = [
+        (node, target_host)
+        for node, ok, result, (target_host, _) in zip(nodes, built, evaluated, hosts)
+        if ok and result.out_path and target_host
+    ]
+    out_paths = {node.name: result.out_path for node, result in zip(nodes, evaluated)}
+    sites = fanout_sites(members)
+    if not sites:
+        return
 
-        # Deployment failure (not connection-related) - return error immediately
-        print(f"{RED}[ ✗ ]{NC} {log_prefix}{node.name} - deployment failed")
-        lines = output.strip().split("\n")
-        if lines:
-            print(f"{YELLOW}[ * ]{NC} Last output:")
-            for line in lines[-10:]:
-                print(f"    {line}")
-        return node.name, False, output
+    sent = {"workstation": 0, "peers": 0}
+    await asyncio.gather(*(
+        seed_site(site, [(node, host, out_paths[node.name]) for node, host in group], sent)
+        for site, group in sites.items()
+    ))
+    print(
+        f"{GREEN}[ ✓ ]{NC} Fan-out: {format_size(sent['workstation'])} sent from this machine, "
+        f"{format_size(sent['peers'])} copied between peers ({len(sites)} site(s))"
+    )
 
-    return node.name, False, output
 
+class Scheduler:
+    """Bounded concurrency for parallel deploys.
 
-async def deploy_node(node: Node, prefix: str = "") -> tuple[str, bool, str]:
+    A global limit caps how many nodes are in flight ("node" queue, --jobs).
+    Within a node, each phase takes a slot from its own pool ("build",
+    "transfer", "activate"), and LXC boosts take one from their Proxmox
+    host's pool ("pve:<node>"). The time each node spends waiting in each
+    queue is recorded for the deployment summary.
     """
-    Deploy to a single node asynchronously.
 
-    Args:
-        node: The node to deploy to
-        prefix: Optional prefix for log messages (used in parallel mode)
+    def __init__(self, limits: dict[str, int], pve_limits: dict[str, int]) -> None:
+        self.limits = limits
+        self.pve_limits = pve_limits
+        self.semaphores: dict[str, asyncio.Semaphore | None] = {}
+        self.waits: dict[str, dict[str, float]] = defaultdict(lambda: defaultdict(float))
+
+    def _limit(self, queue: str) -> int:
+        if queue == "node":
+            return self.limits.get("jobs", 0)
+        if queue.startswith("pve:"):
+            return self.pve_limits.get(queue[4:], self.limits.get("pve", 0))
+        return self.limits.get(queue, 0)
+
+    @asynccontextmanager
+    async def slot(self, node_name: str, queue: str):
+        """Hold a slot in `queue` for the duration of the block (0 = unlimited)."""
+        if queue not in self.semaphores:
+            limit = self._limit(queue)
+            self.semaphores[queue] = asyncio.Semaphore(limit) if limit > 0 else None
+        semaphore = self.semaphores[queue]
+        if semaphore is None:
+            yield
+            return
+
+        start = time.monotonic()
+        async with semaphore:
+            self.waits[node_name][queue] += time.monotonic() - start
+            yield
+
+    def record_wait(self, node_name: str, queue: str, seconds: float) -> None:
+        """Count time a node was held back outside the scheduler's own pools."""
+        self.waits[node_name][queue] += seconds
+
+    def waited(self, node_name: str) -> float:
+        """Seconds the node spent queued once started (the "node" queue comes before it starts)."""
+        return sum(secs for queue, secs in self.waits[node_name].items() if queue != "node")
+
+    def wait_summary(self, node_name: str) -> str:
+        """Human-readable queue waits for a node (empty if it never waited)."""
+        waits = [f"{queue} {secs:.1f}s" for queue, secs in self.waits[node_name].items() if secs >= 0.1]
+        return f"queued: {', '.join(waits)}" if waits else ""
+
+
+# Scheduler for parallel runs, set up by run_plan() (None = no limits)
+SCHEDULER: Scheduler | None = None
+
+
+@asynccontextmanager
+async def phase_slot(node: Node, queue: str | None):
+    """Take a scheduler slot for a deploy phase (no-op outside parallel runs)."""
+    if SCHEDULER is None or queue is None:
+        yield
+        return
+    async with SCHEDULER.slot(node.name, queue):
+        yield
+
+
+def get_deploy_limits(jobs: int = 0) -> tuple[dict[str, int], dict[str, int]]:
+    """Merge concurrency limits: defaults < nodes.json "deploy" section < --jobs.
+
+    nodes.json example:
+        "deploy": {"jobs": 6, "limits": {"build": 2, "activate": 4, "pve": 2},
+                   "pveLimits": {"pve3": 1}}
 
     Returns:
-        Tuple of (node_name, success, output)
+        Tuple of (phase limits incl. "jobs", per-Proxmox-host limits)
     """
-    log_prefix = f"[{node.name}] " if prefix else ""
+    deploy_config = load_node_config()["deploy"]
+    limits = dict(DEFAULT_DEPLOY_LIMITS)
+    limits.update(deploy_config.get("limits", {}))
+    if "jobs" in deploy_config:
+        limits["jobs"] = deploy_config["jobs"]
+    if jobs:
+        limits["jobs"] = jobs
+    return limits, dict(deploy_config.get("pveLimits", {}))
 
-    # Determine if this is a local or remote deployment
-    if is_local_deploy(node):
-        print(
-            f"{BLUE}[ * ]{NC} {log_prefix}Deploying to {BOLD}{node.name}{NC} (local)..."
-        )
-        cmd = build_local_command(node)
 
-        if VERBOSE:
-            # Stream output in real-time
-            proc = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdout=None,  # Inherit stdout
-                stderr=None,  # Inherit stderr
-            )
-            await proc.wait()
-            output = ""
-            success = proc.returncode == 0
-        else:
-            proc = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.STDOUT,
-            )
-            stdout, _ = await proc.communicate()
-            output = stdout.decode()
-            success = proc.returncode == 0
+def predict_durations(nodes: list[Node]) -> dict[str, float]:
+    """Predicted deploy duration per node from history.
 
-        if success:
-            print(f"{GREEN}[ ✓ ]{NC} {log_prefix}{node.name} - deployment successful")
-        else:
-            print(f"{RED}[ ✗ ]{NC} {log_prefix}{node.name} - deployment failed")
-            if not VERBOSE:
-                lines = output.strip().split("\n")
-                if lines:
-                    print(f"{YELLOW}[ * ]{NC} Last output:")
-                    for line in lines[-5:]:
-                        print(f"    {line}")
+    Nodes without history get the longest known prediction, so unknown
+    (possibly slow) nodes are started early rather than last.
+    """
+    predictions = {node.name: HISTORY.predict(node.name) for node in nodes}
+    fallback = max((p for p in predictions.values() if p is not None), default=0.0)
+    return {name: p if p is not None else fallback for name, p in predictions.items()}
 
-        return node.name, success, output
-    else:
-        # Remote deployment
-        # When using local build, skip remote preparation (no need to copy age/ssh keys)
-        if not LOCAL_BUILD:
-            # Ensure remote is prepared first
-            if not ensure_remote_prepared(node):
-                print(f"{RED}[ ✗ ]{NC} {log_prefix}{node.name} - remote not prepared and setup failed")
-                return node.name, False, "Remote not prepared for deployment"
 
-        # Remote deployment - try each host in order
-        return await try_remote_hosts(node, prefix)
+def predict_wall_clock(durations: list[float], slots: int) -> float:
+    """Wall-clock of running jobs longest-first on `slots` workers (0 = unlimited)."""
+    if not durations:
+        return 0.0
+    if slots <= 0 or slots >= len(durations):
+        return max(durations)
+    finish_times = [0.0] * slots
+    for duration in sorted(durations, reverse=True):
+        earliest = finish_times.index(min(finish_times))
+        finish_times[earliest] += duration
+    return max(finish_times)
 
 
 async def deploy_parallel(nodes: list[Node]) -> bool:
@@ -840,8 +3764,19 @@ async def deploy_parallel(nodes: list[Node]) -> bool:
     )
     print()
 
-    tasks = [deploy_node(node, prefix="parallel") for node in nodes]
-    results = await asyncio.gather(*tasks)
+    async def run_node(node: Node) -> tuple[str, bool, str]:
+        async with phase_slot(node, "node"):
+            return await deploy_node(node, prefix="parallel")
+
+    # Longest job first: slots are handed out in task creation order, so
+    # starting the historically slowest nodes first shortens the run
+    predictions = predict_durations(nodes)
+    ordered = sorted(nodes, key=lambda n: predictions[n.name], reverse=True)
+    outcomes = {
+        result[0]: result
+        for result in await asyncio.gather(*(run_node(node) for node in ordered))
+    }
+    results = [outcomes[node.name] for node in nodes]
 
     # Print summary
     print()
@@ -849,43 +3784,361 @@ async def deploy_parallel(nodes: list[Node]) -> bool:
     all_success = True
     for name, success, _ in results:
         status = f"{GREEN}[ ✓ ]{NC}" if success else f"{RED}[ ✗ ]{NC}"
-        print(f"  {status} {name}")
+        waits = SCHEDULER.wait_summary(name) if SCHEDULER else ""
+        print(f"  {status} {name}" + (f" ({waits})" if waits else ""))
         if not success:
             all_success = False
 
     return all_success
 
 
-def deploy_sequential(nodes: list[Node]) -> bool:
+class LookaheadBuilds:
+    """Builds the next nodes of a sequential run while the current one deploys.
+
+    Deployments stay strictly one at a time. The local builds (cache-fetch
+    pre-builds, the build half of -L) of the current node and the next
+    `depth` ones run as a chain in node order, one at a time as before, so
+    the next node builds while the current one activates. Evaluation
+    already runs ahead for every node in the EvalEngine. Builds started
+    ahead log behind a "[node]" prefix. When a node's turn comes its deploy
+    awaits the build started for it, and discard() cancels the builds of
+    nodes that will not be deployed after all.
+    """
+
+    def __init__(self, nodes: list[Node], depth: int, current_host: str) -> None:
+        self.nodes = nodes
+        self.depth = depth
+        self.current_host = current_host
+        self.tasks: dict[str, asyncio.Task] = {}
+        self.started: set[str] = set()
+        self.last: asyncio.Task | None = None  # end of the build chain
+
+    def advance(self, index: int) -> None:
+        """Queue the builds of nodes[index] and the (up to depth) nodes after it."""
+        for i in range(index, min(index + 1 + self.depth, len(self.nodes))):
+            node = self.nodes[i]
+            if node.name in self.started:
+                continue
+            self.started.add(node.name)
+            # The local node and -R nodes have nothing to build here ahead of time
+            if node.name == self.current_host or deploy_mode(node) == "remote-build":
+                continue
+            self.last = asyncio.create_task(self.build(node, self.last, ahead=i > index))
+            self.tasks[node.name] = self.last
+
+    async def build(self, node: Node, previous: asyncio.Task | None, ahead: bool) -> bool:
+        """Build node once the build queued before it has finished."""
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)
+        return await _prebuild_locally(node, prefix="lookahead" if ahead else "")
+
+    def take(self, node: Node) -> asyncio.Task | None:
+        """Hand over the build started ahead for node, if any."""
+        return self.tasks.pop(node.name, None)
+
+    async def drop(self, node: Node) -> None:
+        """Cancel node's build if its deploy ended without needing it (e.g. host unreachable)."""
+        if (task := self.tasks.pop(node.name, None)) is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def discard(self) -> None:
+        """Cancel the builds started for nodes that were not deployed."""
+        unfinished = [name for name, task in self.tasks.items() if not task.done()]
+        for task in self.tasks.values():
+            task.cancel()
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+        self.tasks.clear()
+        if unfinished:
+            print(f"{BLUE}[ * ]{NC} Cancelled builds started ahead for: {', '.join(unfinished)}")
+
+
+# Builds started ahead in the current sequential run (--lookahead)
+LOOKAHEAD: LookaheadBuilds | None = None
+
+
+async def read_answer(prompt: str) -> str:
+    """input(prompt) without blocking the event loop.
+
+    The read runs in a daemon thread rather than the default executor: Ctrl-C
+    cancels the awaiting task at once, and the abandoned read neither delays
+    the exit nor waits for Enter.
+    """
+    loop = asyncio.get_running_loop()
+    answer = loop.create_future()
+
+    def settle(result: str | None, error: BaseException | None) -> None:
+        if answer.done():
+            return
+        if error is not None:
+            answer.set_exception(error)
+        else:
+            answer.set_result(result)
+
+    def read() -> None:
+        try:
+            result, error = input(prompt), None
+        except (EOFError, OSError) as e:
+            result, error = None, e
+        try:
+            loop.call_soon_threadsafe(settle, result, error)
+        except RuntimeError:
+            pass  # the loop is gone (the run ended while waiting)
+
+    threading.Thread(target=read, name="prompt", daemon=True).start()
+    return await answer
+
+
+async def deploy_sequential(nodes: list[Node]) -> bool:
     """
     Deploy to multiple nodes sequentially.
 
+    With --lookahead N the next N nodes are built while the current one
+    deploys (see LookaheadBuilds).
+
     Args:
         nodes: List of nodes to deploy to
 
     Returns:
         True if all deployments succeeded
     """
+    global LOOKAHEAD
+    if LOOKAHEAD_DEPTH > 0:
+        LOOKAHEAD = LookaheadBuilds(nodes, LOOKAHEAD_DEPTH, await get_current_host())
     all_success = True
-    for i, node in enumerate(nodes, 1):
-        print(f"\n{BLUE}[ * ]{NC} Deploying {i}/{len(nodes)}...")
-        _, success, _ = asyncio.run(deploy_node(node))
-        if not success:
-            all_success = False
-            # Ask whether to continue on failure
-            if i < len(nodes):
-                print(
-                    f"{YELLOW}[ ! ]{NC} Deployment to {node.name} failed. Continue with remaining nodes? [y/N] ",
-                    end="",
-                )
-                try:
-                    response = input().strip().lower()
-                    if response not in ("y", "yes"):
-                        print(f"{BLUE}[ * ]{NC} Stopping deployment.")
+    try:
+        for i, node in enumerate(nodes, 1):
+            print(f"\n{BLUE}[ * ]{NC} Deploying {i}/{len(nodes)}...")
+            if LOOKAHEAD is not None:
+                LOOKAHEAD.advance(i - 1)
+            _, success, _ = await deploy_node(node)
+            if LOOKAHEAD is not None:
+                await LOOKAHEAD.drop(node)
+            if not success:
+                all_success = False
+                # Ask whether to continue on failure (builds running ahead keep
+                # going meanwhile); a node skipped for an already reported
+                # failure doesn't ask again
+                if i < len(nodes) and node.name not in FAILURES.skipped:
+                    prompt = f"{YELLOW}[ ! ]{NC} Deployment to {node.name} failed. Continue with remaining nodes? [y/N] "
+                    try:
+                        response = (await read_answer(prompt)).strip().lower()
+                        if response not in ("y", "yes"):
+                            print(f"{BLUE}[ * ]{NC} Stopping deployment.")
+                            break
+                    except (EOFError, OSError):
+                        print(f"\n{BLUE}[ * ]{NC} Stopping deployment.")
                         break
-                except (EOFError, KeyboardInterrupt):
-                    print(f"\n{BLUE}[ * ]{NC} Stopping deployment.")
-                    break
+                    except asyncio.CancelledError:
+                        # Ctrl-C at the prompt (asyncio.run cancels the main task):
+                        # stop like a "no" so the run still reports and cleans up
+                        asyncio.current_task().uncancel()
+                        print(f"\n{BLUE}[ * ]{NC} Stopping deployment.")
+                        break
+    finally:
+        if LOOKAHEAD is not None:
+            await LOOKAHEAD.discard()
+            LOOKAHEAD = None
+    return all_success
+
+
+def can_stage(node: Node, current_host: str) -> bool:
+    """Only remote NixOS nodes can be staged (activation is switch-to-configuration)."""
+    return node.type == "nixos" and node.name != current_host
+
+
+async def stage_node(node: Node, prefix: str = "") -> tuple[str, bool, str]:
+    """Realise a node's evaluated toplevel on its remote without activating it (--stage).
+
+    Returns:
+        Tuple of (node_name, success, output)
+    """
+    log_prefix = f"[{node.name}] " if prefix else ""
+    source = None
+    evaluated = await EVALUATOR.result(node.name)
+    if evaluated.error or not evaluated.out_path:
+        FAILURES.report(node, evaluated.error or "", log_prefix, "Evaluation failed")
+        return node.name, False, evaluated.error or ""
+
+    with timed_phase(node.name, "probe") as phase:
+        target_host, error = await race_target_hosts(node)
+        phase["success"] = target_host is not None
+    if target_host is None:
+        print(f"{RED}[ ✗ ]{NC} {log_prefix}{node.name} - all hosts unreachable")
+        return node.name, False, error
+
+    mode = deploy_mode(node)
+    if mode == "remote-build":
+        with timed_phase(node.name, "prepare") as phase:
+            phase["success"] = await ensure_remote_prepared(node, log_prefix)
+        if not phase["success"]:
+            return node.name, False, "Failed to prepare remote"
+        if SHIP_SOURCE:
+            with timed_phase(node.name, "ship-source") as phase:
+                source, output = await FLAKE_SOURCE.ship(node, target_host)
+                phase["success"] = source is not None
+            if source is None:
+                print(f"{RED}[ ✗ ]{NC} {log_prefix}{node.name} - shipping flake source failed")
+                return node.name, False, output
+        else:
+            with timed_phase(node.name, "git-pull") as phase:
+                success, tail = await run_deploy_command(
+                    build_remote_pull_command(node, target_host), prefix=log_prefix
+                )
+                phase["success"] = success
+            if not success:
+                print(f"{RED}[ ✗ ]{NC} {log_prefix}{node.name} - git pull on remote failed")
+                return node.name, False, tail.text
+    else:
+        with timed_phase(node.name, "prebuild") as phase:
+            phase["success"] = await prebuild_locally(node, prefix)
+        if not phase["success"]:
+            return node.name, False, "Local pre-build failed"
+        if mode == "cache-fetch":
+            mode = await rechoose_mode(node, target_host, log_prefix)
+        if mode == "cache-fetch":
+            await ensure_cached(node, log_prefix)
+
+    print(f"{BLUE}[ * ]{NC} {log_prefix}Staging {BOLD}{node.name}{NC} on {target_host}...")
+    env = get_nix_ssh_env(node.ssh_port, target_host)
+    stage_phase = "transfer" if mode == "local-push" else "activate"
+    # Only remote-build builds on the remote, so only then does the LXC need a boost
+    pve_queue = f"pve:{node.pve_node}" if node.pve_node and mode == "remote-build" else None
+    async with phase_slot(node, stage_phase), phase_slot(node, pve_queue):
+        async with (boosted_lxc(node, prefix) if mode == "remote-build" else nullcontext()):
+            with timed_phase(node.name, "stage") as phase:
+                success, tail = True, None
+                if mode == "local-push":
+                    success, tail = await run_deploy_command(
+                        ["nix-copy-closure", "--to", target_host, evaluated.out_path], env, prefix=log_prefix
+                    )
+                if success:
+                    success, tail = await run_deploy_command(
+                        build_stage_command(node, target_host, evaluated.out_path, source), env, prefix=log_prefix
+                    )
+                phase["success"] = success
+
+    if not success:
+        print(f"{RED}[ ✗ ]{NC} {log_prefix}{node.name} - staging failed")
+        for line in tail.last(5):
+            print(f"    {line}")
+        return node.name, False, tail.text
+
+    STAGED.record(node.name, target_host, evaluated.out_path)
+    print(f"{GREEN}[ ✓ ]{NC} {log_prefix}{node.name} - staged {evaluated.out_path}")
+    return node.name, True, ""
+
+
+async def switch_node(node: Node, prefix: str = "") -> tuple[str, bool, str]:
+    """Activate a node's staged toplevel (--switch).
+
+    Returns:
+        Tuple of (node_name, success, output)
+    """
+    log_prefix = f"[{node.name}] " if prefix else ""
+    entry = STAGED.get(node.name)
+    if entry is None:
+        print(f"{RED}[ ✗ ]{NC} {log_prefix}{node.name} - nothing staged (run --stage first)")
+        return node.name, False, "nothing staged"
+
+    target_host, out_path = entry["host"], entry["outPath"]
+    with timed_phase(node.name, "switch") as phase:
+        success, tail = await run_deploy_command(
+            build_switch_command(node, target_host, out_path),
+            get_nix_ssh_env(node.ssh_port, target_host),
+            prefix=log_prefix,
+        )
+        phase["success"] = success
+
+    if not success:
+        print(f"{RED}[ ✗ ]{NC} {log_prefix}{node.name} - switch failed")
+        for line in tail.last(5):
+            print(f"    {line}")
+        return node.name, False, tail.text
+
+    STAGED.remove(node.name)
+    print(f"{GREEN}[ ✓ ]{NC} {log_prefix}{node.name} - switched to {out_path}")
+    if GC_MODE == "always":
+        with timed_phase(node.name, "cleanup") as phase:
+            phase["success"] = await cleanup_remote(target_host, node.ssh_port)
+    elif GC_MODE == "auto":
+        GC_PENDING.append((node, target_host))
+    return node.name, True, ""
+
+
+async def deploy_staged(nodes: list[Node], stage: bool, switch: bool) -> bool:
+    """
+    Two-phase deploy: stage every node's closure, then switch them all at once.
+
+    Staging transfers and realises the new systems in parallel (within the
+    scheduler's limits) without activating anything. Switching then
+    activates all staged nodes with unlimited concurrency, as nothing is
+    transferred any more, so the fleet only runs mixed configurations for
+    the length of the switch phase.
+
+    Returns:
+        True if every requested phase succeeded on every node
+    """
+    all_success = True
+    stage_results: dict[str, bool] = {}
+    stage_time = switch_time = None
+
+    if stage:
+        names = ", ".join(n.name for n in nodes)
+        print(f"{BLUE}[ * ]{NC} Staging {len(nodes)} node(s): {BOLD}{names}{NC}")
+        print()
+
+        async def run_stage(node: Node) -> tuple[str, bool, str]:
+            async with phase_slot(node, "node"):
+                return await stage_node(node, prefix="parallel")
+
+        start = time.monotonic()
+        predictions = predict_durations(nodes)
+        ordered = sorted(nodes, key=lambda n: predictions[n.name], reverse=True)
+        for name, success, _ in await asyncio.gather(*(run_stage(node) for node in ordered)):
+            stage_results[name] = success
+        stage_time = time.monotonic() - start
+        all_success = all(stage_results.values())
+
+    switch_results: dict[str, bool] = {}
+    if switch:
+        # In a combined run, only switch what was staged successfully just now
+        to_switch = [n for n in nodes if stage_results.get(n.name, not stage)]
+        if to_switch:
+            print()
+            print(f"{BLUE}[ * ]{NC} Switching {len(to_switch)} staged node(s) at once...")
+            start = time.monotonic()
+            for name, success, _ in await asyncio.gather(
+                *(switch_node(node, prefix="parallel") for node in to_switch)
+            ):
+                switch_results[name] = success
+            switch_time = time.monotonic() - start
+            all_success = all_success and all(switch_results.values())
+
+    # Print summary
+    print()
+    print(f"{BLUE}[ * ]{NC} {BOLD}Deployment Summary:{NC}")
+    for node in nodes:
+        if node.name in switch_results:
+            ok, what = switch_results[node.name], "switched" if switch_results[node.name] else "switch failed"
+        elif node.name in stage_results:
+            ok, what = stage_results[node.name], "staged" if stage_results[node.name] else "staging failed"
+        else:
+            ok, what = False, "not switched"
+        status = f"{GREEN}[ ✓ ]{NC}" if ok else f"{RED}[ ✗ ]{NC}"
+        waits = SCHEDULER.wait_summary(node.name) if SCHEDULER else ""
+        print(f"  {status} {node.name} ({what}" + (f"; {waits})" if waits else ")"))
+    if stage_time is not None:
+        staged = sum(stage_results.values())
+        print(f"{BLUE}[ * ]{NC} Stage: {staged}/{len(nodes)} node(s) in {format_duration(stage_time)}")
+    if switch_time is not None:
+        switched = sum(switch_results.values())
+        print(
+            f"{BLUE}[ * ]{NC} Switch: {switched}/{len(switch_results)} node(s) in {format_duration(switch_time)}"
+            f" (fleet ran mixed configurations for {format_duration(switch_time)})"
+        )
+    elif stage and all_success:
+        print(f"{BLUE}[ * ]{NC} Activate with: rebuild --switch")
     return all_success
 
 
@@ -1023,9 +4276,8 @@ def build_proxmox_images(vm: bool = False, vm_qcow2: bool = False, lxc: bool = F
     return all_success
 
 
-def list_nodes(nodes: dict[str, Node], tailscale_up: bool = True) -> None:
+def list_nodes(nodes: dict[str, Node], current_host: str, tailscale_up: bool = True) -> None:
     """Print all available nodes and tags."""
-    current_host = get_current_host()
     ts_status = f"{GREEN}connected{NC}" if tailscale_up else f"{YELLOW}disconnected{NC}"
     print(f"{BOLD}Nodes:{NC} (current host: {current_host}, tailscale: {ts_status})")
     for name in sorted(nodes.keys()):
@@ -1048,6 +4300,227 @@ def list_nodes(nodes: dict[str, Node], tailscale_up: bool = True) -> None:
         print(f"  {tag}: {', '.join(matching)}")
 
 
+def print_dry_run(targets: list[Node], current_host: str, parallel: bool, jobs: int) -> None:
+    """Print what would be deployed and how, with a predicted wall-clock ETA."""
+    print(f"{BOLD}Would deploy to:{NC} (current host: {current_host})")
+    predictions = predict_durations(targets)
+    for node in targets:
+        is_local = node.name == current_host
+        if is_local:
+            method = "local"
+            cmd = build_local_command(node)
+            print(f"  {node.name} ({node.type}, {method})")
+            print(f"    cmd: {' '.join(cmd)}")
+        else:
+            hosts_str = " -> ".join(node.target_hosts)
+            mode = deploy_mode(node)
+            method = f"{mode} ({hosts_str})"
+            print(f"  {node.name} ({node.type}, {method})")
+            if node.name in MODE_CHOICES:
+                print(f"    mode: {MODE_CHOICES[node.name].reason}")
+            elif DEPLOY_MODE == "auto":
+                print("    mode: auto, chosen when deploying (not probed in a dry run)")
+            for i, host in enumerate(node.target_hosts):
+                pfx = "    cmd" if len(node.target_hosts) == 1 else f"    [{i+1}]"
+                if mode == "local-push":
+                    cmd = build_local_push_command(node, host)
+                elif SHIP_SOURCE:
+                    print(f"{pfx}: nix-copy-closure --to {host} <flake source>")
+                    cmd = build_remote_ssh_command(node, host, "<flake source>")
+                else:
+                    print(f"{pfx}: {' '.join(build_remote_pull_command(node, host))}")
+                    cmd = build_remote_ssh_command(node, host)
+                print(f"{pfx}: {' '.join(cmd)}")
+            if mode == "cache-fetch" and BuildPool.remote_host(node):
+                print(f"    pre: nix build --store ssh-ng://<{BuildPool.remote_host(node)}> <toplevel drv>^* "
+                      "(or another build host of this run with a lower load)")
+            elif mode == "cache-fetch":
+                print(f"    pre: nix build {FLAKE_PATH}#{toplevel_attr(node)} --impure --no-link")
+            if node.pve_node:
+                print(f"    boost: {plan_boost(node).describe()}")
+        known = HISTORY.predict(node.name)
+        print(f"    eta: {format_duration(known) if known is not None else 'unknown (no history)'}")
+
+    durations = list(predictions.values())
+    if parallel and len(targets) > 1:
+        eta = predict_wall_clock(durations, jobs)
+        how = f"parallel, {jobs or 'unlimited'} slot(s), longest first"
+    else:
+        eta = sum(durations)
+        how = "sequential"
+    with_history = sum(1 for node in targets if HISTORY.predict(node.name) is not None)
+    if not with_history:
+        print(f"{BOLD}Predicted wall-clock:{NC} unknown (no history)")
+    else:
+        note = (
+            f"; based on {with_history} of {len(targets)} node(s), the rest assumed as slow as the slowest"
+            if with_history < len(targets) else ""
+        )
+        print(f"{BOLD}Predicted wall-clock:{NC} {format_duration(eta)} ({how}{note})")
+
+    if FAN_OUT:
+        pushed = [
+            (node, node.target_hosts[0]) for node in targets
+            if node.name != current_host and deploy_mode(node) == "local-push" and node.target_hosts
+        ]
+        sites = fanout_sites(pushed)
+        print(f"{BOLD}Fan-out:{NC} {'' if sites else 'no site with more than one -L node'}")
+        for site, group in sites.items():
+            print(f"  {site}: this machine -> {describe_fanout_tree(group)}")
+
+
+def print_staged_dry_run(targets: list[Node], stage: bool, switch: bool) -> None:
+    """Print what --stage / --switch would run on each node."""
+    phases = " + ".join(p for p, on in [("stage", stage), ("switch", switch)] if on)
+    print(f"{BOLD}Would {phases}:{NC}")
+    for node in targets:
+        entry = STAGED.get(node.name)
+        print(f"  {node.name} ({node.type})")
+        if stage:
+            host = node.target_hosts[0]
+            if node.name in MODE_CHOICES:
+                print(f"    mode: {deploy_mode(node)} ({MODE_CHOICES[node.name].reason})")
+            if deploy_mode(node) == "local-push":
+                print(f"    copy: nix-copy-closure --to {host} <toplevel>")
+            source = "<flake source>" if SHIP_SOURCE else None
+            print(f"    stage: {' '.join(build_stage_command(node, host, '<toplevel>', source))}")
+        if switch:
+            if stage:
+                host, out_path = node.target_hosts[0], "<toplevel>"
+            elif entry:
+                host, out_path = entry["host"], entry["outPath"]
+                print(f"    staged {format_duration(time.time() - entry['staged'])} ago")
+            else:
+                print("    nothing staged")
+                continue
+            print(f"    switch: {' '.join(build_switch_command(node, host, out_path))}")
+
+
+async def run_plan(targets: list[Node], nodes: dict[str, Node], current_host: str, args) -> bool:
+    """
+    Evaluate, pre-flight and deploy the selected nodes in one event loop.
+
+    Returns:
+        True if all deployments succeeded (or nothing needed deploying)
+    """
+    global EVALUATOR, BATCH_BUILD, SCHEDULER, BUILD_POOL
+    if args.events_file:
+        TIMINGS.open_events_file(args.events_file)
+    limits, pve_limits = get_deploy_limits(args.jobs)
+    # The current host is switched by nh, which evaluates its configuration itself
+    remote = [node for node in targets if node.name != current_host]
+    workers = max(1, min(len(remote), limits["jobs"] or max(1, (os.cpu_count() or 2) // 2)))
+    EVALUATOR = EvalEngine(remote, workers=workers, max_rss_mib=args.eval_max_rss)
+
+    try:
+        if not args.dry_run:
+            # Before any Proxmox inventory is read: undo boosts an interrupted run left in place
+            await restore_leftover_boosts()
+            # Journal multi-node deploy runs for --resume (a single node is simply rerun)
+            if not (args.stage or args.switch) and (len(targets) > 1 or args.resume):
+                if pid := JOURNAL.running_elsewhere():
+                    print(f"{YELLOW}[ ! ]{NC} Another rebuild (pid {pid}) is journalling its run, not journalling this one")
+                elif args.resume:
+                    JOURNAL.resume()
+                else:
+                    JOURNAL.begin([node.name for node in targets])
+
+        staged_only = args.switch and not args.stage
+        if args.stage or args.switch:
+            unstageable = [node for node in targets if not can_stage(node, current_host)]
+            for node in unstageable:
+                print(f"{YELLOW}[ ! ]{NC} {node.name} - cannot be staged (local or darwin), deploy it normally")
+            targets = [node for node in targets if can_stage(node, current_host)]
+            if not targets:
+                return False
+
+        # Pre-flight: drop nodes whose current system already matches the evaluated one
+        # (a plain --switch activates what was staged, so there is nothing to evaluate).
+        # Only worth an evaluation of its own for several nodes: a single node's
+        # deploy either builds from the same evaluation or evaluates again anyway.
+        # A dry run touches no node, so it skips this and the --mode=auto probes.
+        preflight = not args.dry_run and not args.force and not staged_only
+        if preflight and remote and (len(targets) > 1 or args.resume):
+            unchanged = await find_unchanged_nodes(remote, current_host)
+            for node in targets:
+                if node.name in unchanged:
+                    print(f"{GREEN}[ ✓ ]{NC} {node.name} - unchanged ({unchanged[node.name]})")
+                    JOURNAL.finish_node(node.name, "unchanged")
+            targets = [node for node in targets if node.name not in unchanged]
+            if not targets:
+                print(f"{GREEN}[ ✓ ]{NC} All nodes are up to date (use --force to redeploy)")
+                return True
+
+        if DEPLOY_MODE == "auto" and not staged_only and not args.dry_run:
+            await choose_modes(targets, current_host)
+
+        if args.dry_run:
+            if args.stage or args.switch:
+                print_staged_dry_run(targets, args.stage, args.switch)
+            else:
+                print_dry_run(targets, current_host, args.parallel, limits["jobs"])
+            return True
+
+        # Read each involved Proxmox host's container inventory while we evaluate/build
+        PVE_INVENTORY.prefetch(targets)
+        if SHIP_SOURCE and any(deploy_mode(node) != "local-push" for node in targets):
+            FLAKE_SOURCE.prefetch()
+
+        BUILD_POOL = BuildPool(targets, nodes)
+        fanned = [
+            node for node in targets
+            if FAN_OUT and not staged_only and node.name != current_host and deploy_mode(node) == "local-push"
+        ]
+        if len(fanned) > 1:
+            # Build every pushed node in one batch, then seed them site by site
+            BATCH_BUILD = BatchBuild(fanned)
+            await fan_out(fanned)
+            await BATCH_BUILD.close()
+            BATCH_BUILD = None
+        if args.stage or args.switch:
+            prebuilt = [
+                node for node in targets
+                if deploy_mode(node) != "remote-build" and not BUILD_POOL.uses_remote(node)
+            ]
+            if args.stage and len(prebuilt) > 1:
+                BATCH_BUILD = BatchBuild(prebuilt)
+            SCHEDULER = Scheduler(limits, pve_limits)
+            success = await deploy_staged(targets, args.stage, args.switch)
+        elif len(targets) == 1:
+            _, success, _ = await deploy_node(targets[0])
+        elif args.parallel:
+            # cache-fetch: pre-build every such remote node's toplevel in one nix build
+            prebuilt = [
+                node for node in targets
+                if node.name != current_host and deploy_mode(node) == "cache-fetch"
+                and not BUILD_POOL.uses_remote(node)
+            ]
+            if len(prebuilt) > 1:
+                BATCH_BUILD = BatchBuild(prebuilt)
+            SCHEDULER = Scheduler(limits, pve_limits)
+            success = await deploy_parallel(targets)
+        else:
+            success = await deploy_sequential(targets)
+
+        FAILURES.print_report()
+        RETRIES.print_report()
+        BUILD_POOL.print_report()
+        # Off the critical path: every node is already switched
+        await run_deferred_gc()
+        return success
+    finally:
+        if BATCH_BUILD is not None:
+            await BATCH_BUILD.close()
+        await FAILURES.close()
+        await EVALUATOR.close()
+        CACHE_CHECK.close()
+        # Tear down shared SSH connections (also on Ctrl-C)
+        await SSH_MUX.close()
+        if args.timings:
+            TIMINGS.print_table()
+        TIMINGS.close()
+
+
 def main() -> None:
     parser = ArgumentParser(
         description="Nix deployment tool with parallel execution and tag-based filtering",
@@ -1125,13 +4598,139 @@ def main() -> None:
         action="store_true",
         help="SSH into remote and build there directly (no local pre-build)",
     )
+    parser.add_argument(
+        "--mode",
+        choices=["cache-fetch", "local-push", "remote-build", "auto"],
+        default="cache-fetch",
+        help="How remotes get their new system: cache-fetch = pre-build locally, remote fetches from "
+        "the cache (default); local-push = same as -L; remote-build = same as -R; auto = pick per node "
+        "from the missing closure size and measured link throughput",
+    )
+    parser.add_argument(
+        "--no-cache-check",
+        action="store_true",
+        help="Skip checking that each node's whole closure is in the binary cache (and uploading what "
+        "is missing) before it fetches from there",
+    )
+    parser.add_argument(
+        "--fan-out",
+        action="store_true",
+        help="With -L: push each closure once per site (Proxmox host or subnet) and let the nodes "
+        "copy it on to their siblings",
+    )
+    parser.add_argument(
+        "--keep-going",
+        action="store_true",
+        help="Build every node even when others already failed on a derivation it needs, "
+        "and print each node's failure in full",
+    )
+    parser.add_argument(
+        "--ship-source",
+        action="store_true",
+        help="Copy one snapshot of the flake source (incl. private/) to each remote and rebuild from it "
+        "instead of git pull on every remote",
+    )
+    parser.add_argument(
+        "--stage",
+        action="store_true",
+        help="Realise each node's new system on the remote without activating it (remote NixOS nodes)",
+    )
+    parser.add_argument(
+        "--switch",
+        action="store_true",
+        help="Activate all staged nodes at once (with --stage: stage first, then switch)",
+    )
+    parser.add_argument(
+        "--gc",
+        choices=["auto", "always", "never"],
+        default="auto",
+        help="Remote garbage collection: auto = after all deploys, only when low on disk, "
+        "keeping recent generations (default); always = nix-collect-garbage -d after each deploy",
+    )
+    parser.add_argument(
+        "--race-hosts",
+        action="store_true",
+        help="Probe all target hosts at once (earlier ones get a head start) and deploy via the first to answer",
+    )
+    parser.add_argument(
+        "--lookahead",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Without -p: build the next N nodes while the current one deploys (default: 1, 0 = off)",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=SSH_RETRIES,
+        metavar="N",
+        help=f"Retry each SSH step up to N times on connection errors, with backoff (default: {SSH_RETRIES})",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=0,
+        help="Max nodes deployed at once with -p; also caps evaluation workers "
+        "(default: nodes.json deploy.jobs, else unlimited / half the CPUs for evaluation)",
+    )
+    parser.add_argument(
+        "--eval-max-rss",
+        type=int,
+        default=4096,
+        metavar="MIB",
+        help="Restart an evaluation worker once its RSS exceeds this many MiB (default: 4096)",
+    )
+    parser.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        help="Deploy even to nodes already running the evaluated system",
+    )
+    parser.add_argument(
+        "--timings",
+        action="store_true",
+        help="Print a table of per-node, per-phase durations at the end of the run",
+    )
+    parser.add_argument(
+        "--events-file",
+        metavar="PATH",
+        help="Append one JSON line per finished phase to PATH (for graphing across runs)",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Redeploy the nodes an interrupted or failed multi-node run did not finish",
+    )
+    parser.add_argument(
+        "--refresh-reachability",
+        action="store_true",
+        help="Forget cached target host / Tailscale reachability and probe from scratch",
+    )
     args = parser.parse_args()
+    if args.resume and (args.targets or args.all or args.stage or args.switch):
+        parser.error("--resume takes its nodes from the last run's journal")
+
+    if args.refresh_reachability:
+        REACHABILITY.clear()
 
     # Set global flags
-    global VERBOSE, LOCAL_BUILD, REMOTE_BUILD
+    global VERBOSE, DEPLOY_MODE, RACE_HOSTS, GC_MODE, SHIP_SOURCE, CHECK_CACHE, FAN_OUT, KEEP_GOING, LOOKAHEAD_DEPTH
     VERBOSE = args.verbose
-    LOCAL_BUILD = args.local_build
-    REMOTE_BUILD = args.remote_build
+    if args.local_build:
+        DEPLOY_MODE = "local-push"
+    elif args.remote_build:
+        DEPLOY_MODE = "remote-build"
+    else:
+        DEPLOY_MODE = args.mode
+    RACE_HOSTS = args.race_hosts
+    GC_MODE = args.gc
+    SHIP_SOURCE = args.ship_source
+    CHECK_CACHE = not args.no_cache_check
+    FAN_OUT = args.fan_out
+    KEEP_GOING = args.keep_going
+    RETRIES.retries = max(0, args.retries)
+    LOOKAHEAD_DEPTH = max(0, args.lookahead)
 
     # Check Tailscale connection status
     tailscale_up = is_tailscale_connected()
@@ -1139,10 +4738,11 @@ def main() -> None:
         print(f"{YELLOW}[ ! ]{NC} Tailscale not connected - skipping 100.x.x.x addresses")
 
     nodes = get_nodes(tailscale_up)
+    current_host = asyncio.run(get_current_host())
 
     # Handle --list
     if args.list:
-        list_nodes(nodes, tailscale_up)
+        list_nodes(nodes, current_host, tailscale_up)
         return
 
     # Handle --proxmox, --proxmox-vm, --proxmox-vm-qcow2, --proxmox-lxc
@@ -1157,66 +4757,35 @@ def main() -> None:
     decrypt_cache_key()
 
     # Determine deployment targets
-    if args.all:
+    if args.resume:
+        targets = [nodes[name] for name in JOURNAL.resumable() if name in nodes]
+        if not targets:
+            print(f"{GREEN}[ ✓ ]{NC} Nothing to resume: the last run finished every node")
+            sys.exit(0)
+        print(f"{BLUE}[ * ]{NC} Resuming {len(targets)} node(s): {', '.join(node.name for node in targets)}")
+    elif args.all:
         targets = list(nodes.values())
     elif args.targets:
         targets = expand_targets(args.targets, nodes)
+    elif args.switch and not args.stage:
+        # Default for --switch: everything that is staged
+        targets = [nodes[name] for name in STAGED.names() if name in nodes]
     else:
         # Default: deploy to current host
-        current = get_current_host()
-        if current not in nodes:
+        if current_host not in nodes:
             print(
-                f"{RED}[ ✗ ]{NC} Current host '{current}' not found in configuration"
+                f"{RED}[ ✗ ]{NC} Current host '{current_host}' not found in configuration"
             )
             print(f"Available nodes: {', '.join(sorted(nodes.keys()))}")
             print(f"\nTip: Use 'rebuild --list' to see all nodes and tags")
             sys.exit(1)
-        targets = [nodes[current]]
+        targets = [nodes[current_host]]
 
     if not targets:
         print(f"{RED}[ ✗ ]{NC} No deployment targets found")
         sys.exit(1)
 
-    # Handle --dry-run
-    if args.dry_run:
-        current_host = get_current_host()
-        print(f"{BOLD}Would deploy to:{NC} (current host: {current_host})")
-        for node in targets:
-            is_local = node.name == current_host
-            if is_local:
-                method = "local"
-                cmd = build_local_command(node)
-                print(f"  {node.name} ({node.type}, {method})")
-                print(f"    cmd: {' '.join(cmd)}")
-            else:
-                hosts_str = " -> ".join(node.target_hosts)
-                if LOCAL_BUILD:
-                    mode = "local-build+push"
-                elif REMOTE_BUILD:
-                    mode = "remote-build"
-                else:
-                    mode = "prebuild+remote-activate"
-                method = f"{mode} ({hosts_str})"
-                print(f"  {node.name} ({node.type}, {method})")
-                for i, host in enumerate(node.target_hosts):
-                    if LOCAL_BUILD:
-                        cmd = build_local_push_command(node, host)
-                    else:
-                        cmd = build_remote_ssh_command(node, host)
-                    pfx = "    cmd" if len(node.target_hosts) == 1 else f"    [{i+1}]"
-                    print(f"{pfx}: {' '.join(cmd)}")
-                if not LOCAL_BUILD and not REMOTE_BUILD:
-                    print(f"    pre: nix build {FLAKE_PATH}#nixosConfigurations.{node.name}.config.system.build.toplevel --impure --no-link")
-        return
-
-    # Execute deployment
-    if len(targets) == 1:
-        _, success, _ = asyncio.run(deploy_node(targets[0]))
-    elif args.parallel:
-        success = asyncio.run(deploy_parallel(targets))
-    else:
-        success = deploy_sequential(targets)
-
+    success = asyncio.run(run_plan(targets, nodes, current_host, args))
     sys.exit(0 if success else 1)
 
 
@@ -21,6 +21,9 @@ let
   cacheKeyAgePath = "$HOME/.config/nix/config/private/cache-priv-key.pem.age";
   ageIdentity = "$HOME/.age/age.pem";
 
+  # Binary cache the rebuild script checks before uploading (same as shared/cache.nix)
+  binaryCache = import ./binary-cache.nix;
+
   # Substitutions for deploy.py script template
   # Note: Node config is read directly from private/nodes.json at runtime
   deploySubst = {
@@ -28,7 +31,10 @@ let
     "@cacheKeyAgePath@" = cacheKeyAgePath;
     "@ageIdentity@" = ageIdentity;
     "@ageBin@" = "${pkgs.age}/bin/age";
+    "@binaryCacheUrl@" = binaryCache.url;
     "@nixRemoteSetup@" = "${packages.nix-remote-setup}/bin/nix-remote-setup";
+    # Lix build (lixOverlay), matching the evaluator of the systems being deployed
+    "@nixEvalJobs@" = "${pkgs.nix-eval-jobs}/bin/nix-eval-jobs";
   };
 
   # Helper to apply substitutions to a string